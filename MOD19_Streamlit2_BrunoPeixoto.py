@@ -1,63 +1,152 @@
+import uuid
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import streamlit as st
-from PIL import Image
-from io import BytesIO
+from plots import figure_png
+from export import export_bytes, EXPORT_FORMATS
+from filter_index import FilterIndex, filter_state
+from dataset_registry import REGISTRY
+from sessions import use_dataset
+from disk_cache import DISK_CACHE
+from downloads import lazy_download_button
+from instrumentation import PerfRecorder, stage, perf_panel, PERF_PANEL
+from startup import plotting, static_asset, after_first_paint
+from target_cube import TargetCube
+from sql_backend import open_upload, duckdb_enabled
+from data_loader import (stream_bank_data, memory_report, format_bytes, widget_values,
+                         IngestLimitError, UnsupportedFormatError)
+# Copy-on-Write: a base do cache é compartilhada entre as sessões, então os
+# recortes são visões e qualquer alteração copia só o que mudou
+pd.set_option('mode.copy_on_write',True)
+
+def upload_id(file_data):
+    if st.session_state.get('arquivo_id') != file_data.file_id:
+        st.session_state['dataset_id'] = REGISTRY.dataset_id(file_data)
+        st.session_state['arquivo_id'] = file_data.file_id
+    # a base fica no cache compartilhado enquanto alguma sessão a estiver usando
+    use_dataset(st.session_state['dataset_id'])
+    return st.session_state['dataset_id']
+
+def load_data(file_data,dataset_id,preview):
+    return REGISTRY.get_or_create((dataset_id,'dados'),read_upload,file_data,dataset_id,preview,fixar=True)
+
+# Uploads já convertidos abrem do cache em disco (Arrow mapeado em memória),
+# inclusive depois de reiniciar o processo; só aí as listas dos widgets são
+# montadas da base inteira, na primeira leitura elas vêm dos blocos
+def read_upload(file_data,dataset_id,preview):
+    bank = DISK_CACHE.load(dataset_id,'dados')
+    if bank is not None:
+        return bank, memory_report(bank), widget_values(bank)
+    bank, valores_unicos = stream_upload(file_data,preview)
+    DISK_CACHE.store(dataset_id,'dados',bank)
+    return bank, memory_report(bank), valores_unicos
+
+def stream_upload(file_data,preview):
+    progresso = st.sidebar.progress(0.0,text='Lendo arquivo...')
+
+    def on_chunk(chunk,linhas,fracao):
+        if linhas == len(chunk):
+            preview.write(chunk.head(5))
+        progresso.progress(fracao,text=f'{linhas:,} linhas lidas')
 
-custom_params = {"axes.spines.right": False, "axes.spines.top": False}
-sns.set_theme(style="ticks",rc=custom_params)
-
-@st.cache_data(show_spinner = True)
-def load_data(file_data):
     try:
-        return pd.read_csv(file_data,sep=';')
-    except:
-        return pd.read_excel(file_data)
-
-@st.cache_resource()
-def multiselect_filter(relatorio,col,selecionados):
-    if 'all' in selecionados:
-        return relatorio
-    else:
-        return relatorio[relatorio[col].isin(selecionados)].reset_index(drop=True)
+        return stream_bank_data(file_data,file_data.name,on_chunk=on_chunk)
+    finally:
+        progresso.empty()
+
+def target_perc(proporcao):
+    perc = proporcao.reset_index()
+    perc.columns = ['y','proportion']
+    return perc
 
-@st.cache_resource()
 def df_toString(df):
     return df.to_csv(index=False)
 
-@st.cache_resource()
-def df_toExcel(df):
-    output = BytesIO()
-    writer = pd.ExcelWriter(output,engine='xlsxwriter')
-    df.to_excel(writer,index=False, sheet_name = 'Sheet1')
-    writer.close()
-    processed_data = output.getvalue()
-    return processed_data
+def filtered_export(filter_index,df,idades,selecoes,formato):
+    return export_bytes(filter_index.view(df,idades,selecoes),formato)
+
+def plot_target(bank_raw_target_perc,bank_target_perc,graph_type):
+    # seaborn e matplotlib só são importados quando o primeiro gráfico é desenhado
+    sns, plt = plotting()
+    fig, ax = plt.subplots(1,2, figsize = (6,3))
+
+    if graph_type == 'Barras':
+        sns.barplot(x='y',
+                    y ='proportion',
+                    data = bank_raw_target_perc,
+                    palette=['blue','darkorange'],
+                    ax = ax[0])
+        ax[0].bar_label(ax[0].containers[0])
+        ax[0].set_title('Dados brutos',
+                        fontweight = 'bold')
+
+        sns.barplot(x = 'y',
+                    y = 'proportion',
+                    data = bank_target_perc,
+                    palette=['blue','darkorange'],
+                    ax = ax[1])
+        # filtro sem linhas: a tabela vem vazia e não há barras para rotular
+        if ax[1].containers:
+            ax[1].bar_label(ax[1].containers[0])
+        ax[1].set_title('Dados filtrados',
+                        fontweight = 'bold')
+    else:
+        bank_raw_target_perc.plot(kind='pie', autopct = '%.2f',y='proportion',labels=bank_raw_target_perc['y'],ax=ax[0])
+        ax[0].set_title('Dados brutos',
+                        fontweight = 'bold')
+        bank_target_perc.plot(kind='pie', autopct = '%.2f',y='proportion',labels=bank_target_perc['y'], ax=ax[1])
+        ax[1].set_title('Dados filtrados',
+                        fontweight = 'bold')
+
+    return figure_png(fig)
 
 def main():
     st.set_page_config(page_title = 'Telemarketing Analisys', \
-                       page_icon = './telmarketing_icon.png',
+                       page_icon = static_asset('./telmarketing_icon.png'),
                        layout = 'wide',
                        initial_sidebar_state = 'expanded'
                        )
     st.write('# Telemarketing Analysis')
     st.markdown('---')
 
-    image = Image.open("./Bank-Branding.jpg")
-    st.sidebar.image(image)
+    st.sidebar.image(static_asset("./Bank-Branding.jpg"))
 
     st.sidebar.write("## Faça o upload do arquivo")
 
-    data_file_1 = st.sidebar.file_uploader("Bank marketing data",type=['csv','xlsx'])
+    data_file_1 = st.sidebar.file_uploader("Bank marketing data",type=['csv','xlsx','parquet','feather','arrow'])
 
     if (data_file_1 is not None):
 
-        bank_raw = load_data(data_file_1)
-        bank = bank_raw.copy()
-
         st.write('## Antes dos filtros')
-        st.write(bank_raw.head(5))
+        preview = st.empty()
+
+        dataset_id = upload_id(data_file_1)
+        try:
+            with stage('carga'):
+                if duckdb_enabled():
+                    dados = REGISTRY.get_or_create((dataset_id,'duckdb'),open_upload,data_file_1,dataset_id,data_file_1.name,fixar=True)
+                else:
+                    bank_raw, memoria, valores_unicos = load_data(data_file_1,dataset_id,preview)
+        except (IngestLimitError, UnsupportedFormatError) as erro:
+            st.error(str(erro))
+            st.stop()
+
+        if duckdb_enabled():
+            # base em Parquet no disco: filtros e proporções rodam em SQL no DuckDB
+            bank_raw = None
+            filter_index = cube = dados
+            with stage('indices'):
+                valores_unicos = REGISTRY.get_or_create((dataset_id,'valores'),dados.widget_values,fixar=True)
+                min_age,max_age = REGISTRY.get_or_create((dataset_id,'idades'),dados.value_range,'age',fixar=True)
+            st.sidebar.write(f"Base em disco: {format_bytes(dados.file_size)} ({dados.n_rows:,} linhas)")
+        else:
+            st.sidebar.write(f"Memória: {format_bytes(memoria['memoria_atual'])} "
+                             f"(economia de {format_bytes(memoria['economia'])})")
+            with stage('indices'):
+                filter_index = REGISTRY.get_or_create((dataset_id,'indice'),FilterIndex,bank_raw,fixar=True)
+                cube = REGISTRY.get_or_create((dataset_id,'cubo'),TargetCube,bank_raw,fixar=True)
+            min_age,max_age = bank_raw.age.min(),bank_raw.age.max()
+
+        preview.write(filter_index.head(bank_raw))
 
         with st.sidebar.form(key='my_form'):
 
@@ -67,140 +156,126 @@ def main():
 
             # IDADES
 
-            max_age = int(bank.age.max())
-            min_age = int(bank.age.min())
             idades=st.slider(label = 'Idade',
-                                min_value = min_age,
-                                max_value = max_age,
-                                value = (min_age,max_age),
+                                min_value = int(min_age),
+                                max_value = int(max_age),
+                                value = (int(min_age),int(max_age)),
                                 step = 1)
 
             # PROFISSÕES
-            jobs_list = bank.job.unique().tolist()
+            jobs_list = list(valores_unicos['job'])
             jobs_list.append('all')
             jobs_selected = st.multiselect("Profissão",jobs_list,['all'])
         
             # ESTADO CIVIL
-            marital_list = bank.marital.unique().tolist()
+            marital_list = list(valores_unicos['marital'])
             marital_list.append('all')
             marital_selected = st.multiselect("Estado Civil",marital_list,['all'])
         
             # DEFAULT
-            default_list = bank.default.unique().tolist()
+            default_list = list(valores_unicos['default'])
             default_list.append('all')
             default_selected = st.multiselect("Default",default_list,['all'])
 
             # TEM FINANCIAMENTO IMOBILIÁRIO?
-            housing_list = bank.housing.unique().tolist()
+            housing_list = list(valores_unicos['housing'])
             housing_list.append('all')
             housing_selected = st.multiselect("Tem financiamento imob?",housing_list,['all'])
 
             # TEM EMPRESTIMO?
-            loan_list = bank.loan.unique().tolist()
+            loan_list = list(valores_unicos['loan'])
             loan_list.append('all')
             loan_selected = st.multiselect("Tem empréstimo?",loan_list,['all'])
 
             # MEIO DE CONTATO
-            contact_list = bank.contact.unique().tolist()
+            contact_list = list(valores_unicos['contact'])
             contact_list.append('all')
             contact_selected = st.multiselect("Meio de contato",contact_list,['all'])
 
             # MÊS DO CONTATO
-            month_list = bank.month.unique().tolist()
+            month_list = list(valores_unicos['month'])
             month_list.append('all')
             month_selected = st.multiselect("Mês de contato",month_list,['all'])
 
             # DIA DA SEMANA
-            day_of_week_list = bank.day_of_week.unique().tolist()
+            day_of_week_list = list(valores_unicos['day_of_week'])
             day_of_week_list.append('all')
             day_of_week_selected = st.multiselect("Dia da Semana",day_of_week_list,['all'])
     
             #bank = bank[(bank['age'] >= idades[0]) & (bank['age'] <= idades[1])]
             #bank = bank[bank['job'].isin(jobs_selected)].reset_index(drop=True)
 
-            bank = (bank.query("age >= @idades[0] and age <= @idades[1]")
-                    .pipe(multiselect_filter, 'job',jobs_selected)
-                    .pipe(multiselect_filter, 'marital',marital_selected)
-                    .pipe(multiselect_filter, 'default',default_selected)
-                    .pipe(multiselect_filter, 'housing',housing_selected)
-                    .pipe(multiselect_filter, 'loan',loan_selected)
-                    .pipe(multiselect_filter, 'contact',contact_selected)
-                    .pipe(multiselect_filter, 'month',month_selected)
-                    .pipe(multiselect_filter, 'day_of_week',day_of_week_selected)
-                    )
+            selecoes = {'job':jobs_selected,
+                        'marital':marital_selected,
+                        'default':default_selected,
+                        'housing':housing_selected,
+                        'loan':loan_selected,
+                        'contact':contact_selected,
+                        'month':month_selected,
+                        'day_of_week':day_of_week_selected}
+            estado = filter_state(idades, selecoes)
             
             submit_button = st.form_submit_button(label = 'Aplicar')
 
 
         st.write('## Após os filtros')
-        st.write(bank.head())
+        with stage('filtro'):
+            st.write(filter_index.head(bank_raw,idades,selecoes))
+
 
+        formato = st.radio('Formato do download',list(EXPORT_FORMATS),horizontal=True,
+                           format_func=lambda f: EXPORT_FORMATS[f][0])
+        nome_formato, mime = EXPORT_FORMATS[formato]
 
-        df_xlsx = df_toExcel(bank)
-        st.download_button(label = 'Download da tabela filtrada em EXCEL',
-                           data = df_xlsx,
-                           file_name = 'bank_filtered.xlsx')
+        # os arquivos só são gerados quando pedidos e ficam no cache
+        with stage('download_filtro'):
+            lazy_download_button(st,f'Download da tabela filtrada em {nome_formato.upper()}',
+                                 (dataset_id,formato,'filtro',estado),
+                                 filtered_export,filter_index,bank_raw,idades,selecoes,formato,
+                                 file_name = f'bank_filtered.{formato}',
+                                 mime = mime)
         st.markdown("---")
 
-        bank_raw_target_perc = bank_raw.y.value_counts(normalize=True).reset_index()
-        bank_raw_target_perc.columns = ['y', 'proportion']
-   
-        bank_target_perc = bank.y.value_counts(normalize=True).reset_index()
-        bank_target_perc.columns = ['y','proportion']
+        with stage('proporcoes'):
+            bank_raw_target_perc = target_perc(cube.value_counts(normalize=True))
+            bank_target_perc = target_perc(cube.value_counts(idades,selecoes,normalize=True))
 
         # TABELAS DE PROPORÇÃO E DOWNLOAD
 
         col1,col2 = st.columns(2)
 
-        df_xlsx = df_toExcel(bank_raw_target_perc)
         col1.write('### Proporção original')
         col1.write(bank_raw_target_perc)
-        col1.download_button(label='Download',
-                            data = df_xlsx,
-                            file_name = 'bank_raw_proportion.xlsx')
+        with stage('download_proporcao'):
+            lazy_download_button(col1,'Download',(dataset_id,formato,'proporcao'),
+                                 export_bytes,bank_raw_target_perc,formato,
+                                 file_name = f'bank_raw_proportion.{formato}',
+                                 mime = mime)
 
-        df_xlsx = df_toExcel(bank_target_perc)
         col2.write('### Proporção com filtros')
         col2.write(bank_target_perc)
-        col2.download_button(label='Download',
-                            data = df_xlsx,
-                            file_name = 'bank_filtered_proportion.xlsx')
-
-        fig, ax = plt.subplots(1,2, figsize = (6,3))
-
-        # PLOTS
-        if graph_type == 'Barras':
-            sns.barplot(x='y',
-                        y ='proportion',
-                        data = bank_raw_target_perc,
-                        palette=['blue','darkorange'],
-                        ax = ax[0])
-            ax[0].bar_label(ax[0].containers[0])
-            ax[0].set_title('Dados brutos',
-                            fontweight = 'bold')
-    
-            sns.barplot(x = 'y',
-                        y = 'proportion',
-                        data = bank_target_perc,
-                        palette=['blue','darkorange'],
-                        ax = ax[1])
-            ax[1].bar_label(ax[1].containers[0])
-            ax[1].set_title('Dados filtrados',
-                            fontweight = 'bold')
-        else:
-            bank_raw_target_perc.plot(kind='pie', autopct = '%.2f',y='proportion',labels=bank_raw_target_perc['y'],ax=ax[0])
-            ax[0].set_title('Dados brutos',
-                            fontweight = 'bold')
-            bank_target_perc.plot(kind='pie', autopct = '%.2f',y='proportion',labels=bank_target_perc['y'], ax=ax[1])
-            ax[1].set_title('Dados filtrados',
-                            fontweight = 'bold')
+        with stage('download_proporcao_filtro'):
+            lazy_download_button(col2,'Download',(dataset_id,formato,'proporcao',estado),
+                                 export_bytes,bank_target_perc,formato,
+                                 file_name = f'bank_filtered_proportion.{formato}',
+                                 mime = mime)
+
+        # PLOTS: o PNG fica no cache por base, tipo de gráfico e filtros
+        with stage('grafico'):
+            grafico = REGISTRY.get_or_create((dataset_id,'grafico',graph_type,estado),
+                                             plot_target,bank_raw_target_perc,bank_target_perc,graph_type)
     
         st.write('## Proporção de aceite')
 
-        st.pyplot(plt)
+        st.image(grafico,use_container_width=True)
 
 
 if __name__ == '__main__':
-    main()
+    # tempo, cache e memória de cada etapa vão para o log de desempenho
+    with PerfRecorder('MOD19',st.session_state.setdefault('sessao_id',uuid.uuid4().hex[:8])) as perf:
+        main()
+        if PERF_PANEL:
+            perf_panel(perf,st.sidebar)
+        after_first_paint(perf)
 
     
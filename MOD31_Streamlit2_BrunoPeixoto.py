@@ -1,64 +1,46 @@
+import uuid
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 import streamlit as st
-from PIL import Image
-from io import BytesIO
+from export import export_bytes, EXPORT_FORMATS
 import xlsxwriter
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from dataset_registry import REGISTRY
+from sessions import use_dataset
+from disk_cache import DISK_CACHE
+from downloads import lazy_download_button
+from instrumentation import PerfRecorder, stage, perf_panel, PERF_PANEL
+from startup import plotting, after_first_paint, PLOT_MODULES, CLUSTER_MODULES
+from data_loader import read_table
+from rfv import rfv_table, add_recency, quantile_edges, rfv_segments, RFV_COLUMNS, RFVStore
+from sql_backend import open_upload, duckdb_enabled
+from plots import scatter_by_group, SCATTER_MAX_POINTS, SCATTER_MODES
+from clustering import cluster_sweep, sweep_summary, default_method, CLUSTER_METHODS, K_RANGE
+
+# Copy-on-Write: a base do cache é compartilhada entre as sessões, então os
+# recortes são visões e qualquer alteração copia só o que mudou
+pd.set_option('mode.copy_on_write',True)
+
+def upload_id(file_data):
+    if st.session_state.get('arquivo_id') != file_data.file_id:
+        st.session_state['dataset_id'] = REGISTRY.dataset_id(file_data)
+        st.session_state['arquivo_id'] = file_data.file_id
+    # a base fica no cache compartilhado enquanto alguma sessão a estiver usando
+    use_dataset(st.session_state['dataset_id'])
+    return st.session_state['dataset_id']
+
+@st.cache_resource
+def get_rfv_store():
+    return RFVStore()
+
+def read_compras(file_data):
+    return read_table(file_data,file_data.name,parse_dates=['DiaCompra'])
+
+# Estado por cliente agregado no DuckDB, sem carregar as compras no pandas
+def read_estado(file_data,dataset_id):
+    return open_upload(file_data,dataset_id,file_data.name).purchase_state()
 
-
-custom_params = {"axes.spines.right": False, "axes.spines.top": False}
-sns.set_theme(style="ticks",rc=custom_params)
-
-@st.cache_data(show_spinner = True)
-def load_data(file_data):
-    try:
-        return pd.read_csv(file_data,sep=';')
-    except:
-        return pd.read_excel(file_data)
-
-@st.cache_resource()
-def multiselect_filter(relatorio,col,selecionados):
-    if 'all' in selecionados:
-        return relatorio
-    else:
-        return relatorio[relatorio[col].isin(selecionados)].reset_index(drop=True)
-
-@st.cache_resource()
 def df_toString(df):
     return df.to_csv(index=False)
 
-@st.cache_resource()
-def df_toExcel(df):
-    output = BytesIO()
-    writer = pd.ExcelWriter(output,engine='xlsxwriter')
-    df.to_excel(writer,index=False, sheet_name = 'Sheet1')
-    writer.close()
-    processed_data = output.getvalue()
-    return processed_data
-
-def recencia_class(x,r,q_dict):
-    if x <= q_dict[r][0.25]:
-        return 'A'
-    elif x <= q_dict[r][0.5]:
-        return 'B'
-    elif x <= q_dict[r][0.75]:
-        return 'C'
-    else:
-        return 'D'
-
-def freq_val_class(x,fv,q_dict):
-    if x <= q_dict[fv][0.25]:
-        return 'D'
-    elif x <= q_dict[fv][0.5]:
-        return 'C'
-    elif x <= q_dict[fv][0.75]:
-        return 'B'
-    else:
-        return 'A'
-
 def main():
     st.set_page_config(page_title = 'Análise RFV', \
                        layout = 'wide',
@@ -80,76 +62,108 @@ def main():
 
     st.sidebar.write("## Faça o upload do arquivo")
 
-    data_file_1 = st.sidebar.file_uploader("Bank marketing data",type=['csv','xlsx'])
+    data_file_1 = st.sidebar.file_uploader("Bank marketing data",type=['csv','xlsx','parquet','feather','arrow'])
+
+    # Histórico incremental: cada upload é somado ao estado por cliente já salvo
+    historico = st.sidebar.checkbox('Acumular no histórico RFV',value=False)
+    if historico:
+        store = get_rfv_store()
+        if st.sidebar.button('Limpar histórico'):
+            store.reset()
 
     if (data_file_1 is not None):
 
-        df_compras = pd.read_csv(data_file_1,infer_datetime_format=True,parse_dates=['DiaCompra'])
+        dataset_id = upload_id(data_file_1)
+        with stage('carga'):
+            if duckdb_enabled():
+                estado = REGISTRY.get_or_create((dataset_id,'estado'),read_estado,data_file_1,dataset_id,fixar=True)
+                maior_dia = estado['DiaUltimaCompra'].max()
+            else:
+                # o cache em disco evita ler o upload de novo depois de reiniciar o processo
+                df_compras = REGISTRY.get_or_create((dataset_id,'compras'),DISK_CACHE.get_or_create,
+                                                    dataset_id,'compras',read_compras,data_file_1,
+                                                    fixar=True)
+                maior_dia = df_compras['DiaCompra'].max()
 
         #st.write(df_compras.head())
 
         st.write('## Recência (R)')
         
-        dia_atual = df_compras['DiaCompra'].max()
+        if historico:
+            with stage('historico'):
+                if duckdb_enabled():
+                    store.merge_state(estado,maior_dia,dataset_id)
+                else:
+                    store.update(df_compras,dataset_id)
+            rfv_id = 'historico-' + store.versao
+            dia_atual = store.dia_atual
+            st.sidebar.write(f'Histórico: {store.n_clientes} clientes em {len(store.lotes)} arquivo(s)')
+        else:
+            rfv_id = dataset_id
+            dia_atual = maior_dia
         st.write('Dia máximo na base de dados: ',dia_atual)
 
         st.write('Quantos dias faz que o cliente fez a sua última compra?')
 
-        df_recencia = df_compras.groupby(by='ID_cliente', as_index=False)['DiaCompra'].max()
-        df_recencia.columns = ['ID_cliente','DiaUltimaCompra']
-        df_recencia['Recencia'] = df_recencia['DiaUltimaCompra'].apply(lambda x: (dia_atual - x).days)
-        st.write(df_recencia.head())
-
-        df_recencia.drop('DiaUltimaCompra',axis=1,inplace=True)
+        # R, F e V calculados numa única agregação por cliente
+        with stage('rfv'):
+            if historico:
+                df_rfv_base = REGISTRY.get_or_create((rfv_id,'rfv'),store.table)
+            elif duckdb_enabled():
+                df_rfv_base = REGISTRY.get_or_create((rfv_id,'rfv'),add_recency,estado,dia_atual)
+            else:
+                df_rfv_base = REGISTRY.get_or_create((rfv_id,'rfv'),rfv_table,df_compras,dia_atual)
+        st.write(df_rfv_base[['DiaUltimaCompra','Recencia']].head().reset_index())
 
         st.write('## Frequência (F)')
         st.write('Quantas compras o cliente fez no período?')
 
-        df_frequencia = df_compras[['ID_cliente','CodigoCompra']].groupby('ID_cliente').count().reset_index()
-        df_frequencia.columns = ['ID_cliente','Frequencia']
-        st.write(df_frequencia.head())
+        st.write(df_rfv_base[['Frequencia']].head().reset_index())
 
         st.write('## Valor (V)')
         st.write('Quanto cada cliente gastou no período?')
 
-        df_valor = df_compras[['ID_cliente','ValorTotal']].groupby('ID_cliente').sum().reset_index()
-        df_valor.columns = ['ID_cliente','Valor']
-        st.write(df_valor.head())
+        st.write(df_rfv_base[['Valor']].head().reset_index())
 
         st.write('## Tabela RFV Final')
 
-        df_RF = df_recencia.merge(df_frequencia, on='ID_cliente')
-        df_RFV = df_RF.merge(df_valor, on='ID_cliente')
-        df_RFV.set_index('ID_cliente', inplace=True)
+        df_RFV = df_rfv_base[RFV_COLUMNS]
         st.write(df_RFV.head())
 
         st.markdown('---')
 
         st.write('## Segmentação Utilizando o KMeans')
 
-        quartis = df_RFV.quantile(q=[0.25,0.5,0.75])
-        #st.write(quartis)
+        with stage('classificacao'):
+            quartis = quantile_edges(df_RFV,n_classes=4)
+            #st.write(quartis)
 
-        #st.write('Tabela após a criação dos grupos')
-        df_RFV['R_Quartile'] = df_RFV['Recencia'].apply(recencia_class,
-                                            args = ('Recencia',quartis))
-        df_RFV['F_Quartile'] = df_RFV['Frequencia'].apply(freq_val_class,
-                                            args = ('Frequencia',quartis))
-        df_RFV['V_Quartile'] = df_RFV['Valor'].apply(freq_val_class,
-                                            args = ('Valor',quartis))    
-        
-        df_RFV['RFV_Score'] = df_RFV.R_Quartile + df_RFV.F_Quartile + df_RFV.V_Quartile
+            #st.write('Tabela após a criação dos grupos')
+            df_RFV = rfv_segments(df_RFV,quartis,n_classes=4)
         #st.write(df_RFV.head())
 
-        # Normalização dos dados
-        scaler = StandardScaler()
-        rfv_normalizado = scaler.fit_transform(df_RFV[['Recencia', 'Frequencia', 'Valor']])
+        metodos = list(CLUSTER_METHODS)
+        metodo = st.radio('Algoritmo de agrupamento',metodos,horizontal=True,
+                          index=metodos.index(default_method(len(df_RFV))),
+                          format_func=lambda m: CLUSTER_METHODS[m])
+
+        # Normalização dos dados e agrupamento para todos os K do slider de uma
+        # vez (MiniBatch: ajuste numa amostra); mover o slider só consulta o cache
+        with st.spinner('Agrupando os clientes para cada número de clusters...'), stage('clusters'):
+            varredura = REGISTRY.get_or_create((rfv_id,'varredura',metodo),
+                                               cluster_sweep,df_RFV,K_RANGE,metodo)
+
+        st.write('### Escolha do número de clusters')
+        resumo = sweep_summary(varredura)
+        col_inercia, col_silhueta = st.columns(2)
+        col_inercia.write('Método do cotovelo (inércia)')
+        col_inercia.line_chart(resumo['Inercia'])
+        col_silhueta.write('Silhueta (amostra)')
+        col_silhueta.line_chart(resumo['Silhueta'])
 
         # Definindo número de clusters (ex: 4)
-        n_clusters = st.slider('Escolha o número de clusters K-Means:', min_value=2, max_value=10, value=4)
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init='auto')
-        #kmeans = KMeans(n_clusters=4, random_state=42, n_init='auto')
-        clusters = kmeans.fit_predict(rfv_normalizado)
+        n_clusters = st.slider('Escolha o número de clusters K-Means:', min_value=K_RANGE.start, max_value=K_RANGE.stop - 1, value=4)
+        clusters = varredura[n_clusters]['labels']
 
         # Adicionando cluster ao dataframe
         df_RFV['Cluster'] = clusters
@@ -158,21 +172,31 @@ def main():
         st.write('### Quantidade de clientes por cluster K-Means')
         st.write(df_RFV['Cluster'].value_counts().reset_index().rename(columns={'index': 'Cluster', 'Cluster': 'Grupos de Clientes'}).sort_values(by='Grupos de Clientes', ascending=True))
 
-        # Gráfico de dispersão RFV
+        # Gráfico de dispersão RFV: acima de SCATTER_MAX_POINTS clientes, amostra
+        # estratificada por cluster ou densidade; as figuras são fechadas após exibidas
+        modo = 'amostra'
+        if len(df_RFV) > SCATTER_MAX_POINTS:
+            modo = st.radio('Gráficos de dispersão',list(SCATTER_MODES),horizontal=True,
+                            format_func=lambda m: SCATTER_MODES[m])
+        _, plt = plotting()
+
         st.write('### Gráfico de Dispersão: Frequência vs Valor, por Cluster')
-        fig, ax = plt.subplots()
-        sns.scatterplot(data=df_RFV, x='Frequencia', y='Valor', hue='Cluster', palette='tab10', ax=ax)
-        st.pyplot(fig)
+        with stage('grafico'):
+            fig = scatter_by_group(df_RFV, 'Frequencia', 'Valor', 'Cluster', modo)
+            st.pyplot(fig)
+        plt.close(fig)
 
         st.write('### Gráfico de Dispersão: Recência vs Valor, por Cluster')
-        fig, ax = plt.subplots()
-        sns.scatterplot(data=df_RFV, x='Recencia', y='Valor', hue='Cluster', palette='tab10', ax=ax)
-        st.pyplot(fig)
+        with stage('grafico'):
+            fig = scatter_by_group(df_RFV, 'Recencia', 'Valor', 'Cluster', modo)
+            st.pyplot(fig)
+        plt.close(fig)
 
         st.write('### Gráfico de Dispersão: Recência vs Frequência, por Cluster')
-        fig, ax = plt.subplots()
-        sns.scatterplot(data=df_RFV, x='Recencia', y='Frequencia', hue='Cluster', palette='tab10', ax=ax)
-        st.pyplot(fig)
+        with stage('grafico'):
+            fig = scatter_by_group(df_RFV, 'Recencia', 'Frequencia', 'Cluster', modo)
+            st.pyplot(fig)
+        plt.close(fig)
 
         st.write('### Estatísticas por Cluster')
         stats_cluster = df_RFV.groupby('Cluster')[['Recencia', 'Frequencia', 'Valor']].mean().round(2).reset_index()
@@ -181,14 +205,23 @@ def main():
         st.write('### Base Clusterizada')
         st.write(df_RFV)
 
-        df_xlsx = df_toExcel(df_RFV)
-        st.download_button(label='📥 Download Base',
-                           data=df_xlsx,
-                           file_name='RFV.xlsx')
+        formato = st.radio('Formato do download',list(EXPORT_FORMATS),horizontal=True,
+                           format_func=lambda f: EXPORT_FORMATS[f][0])
+        # o arquivo só é gerado quando pedido e fica no cache
+        with stage('download'):
+            lazy_download_button(st,'📥 Download Base',(rfv_id,formato,'rfv',metodo,n_clusters),
+                                 export_bytes,df_RFV,formato,
+                                 file_name=f'RFV.{formato}',
+                                 mime=EXPORT_FORMATS[formato][1])
     
 
         
 if __name__ == '__main__':
-    main()
+    # tempo, cache e memória de cada etapa vão para o log de desempenho
+    with PerfRecorder('MOD31_2',st.session_state.setdefault('sessao_id',uuid.uuid4().hex[:8])) as perf:
+        main()
+        if PERF_PANEL:
+            perf_panel(perf,st.sidebar)
+        after_first_paint(perf,PLOT_MODULES + CLUSTER_MODULES)
 
     
\ No newline at end of file
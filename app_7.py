@@ -1,54 +1,120 @@
 
 # Imports
+import uuid
 import pandas            as pd
 import streamlit         as st
-import seaborn           as sns
-import matplotlib.pyplot as plt
-from PIL                 import Image
-from io                  import BytesIO
+from export              import export_bytes, EXPORT_FORMATS
+from plots               import figure_png
+from filter_index        import FilterIndex, filter_state
+from dataset_registry    import REGISTRY
+from sessions            import use_dataset
+from disk_cache          import DISK_CACHE
+from downloads           import lazy_download_button
+from instrumentation     import PerfRecorder, stage, perf_panel, PERF_PANEL
+from startup             import plotting, static_asset, after_first_paint
+from target_cube         import TargetCube
+from sql_backend         import open_upload, duckdb_enabled
+from data_loader         import (stream_bank_data, memory_report, format_bytes, widget_values,
+                                 IngestLimitError, UnsupportedFormatError)
+
+# Copy-on-Write: a base do cache é compartilhada entre as sessões, então os
+# recortes são visões e qualquer alteração copia só o que mudou
+pd.set_option('mode.copy_on_write', True)
+
+
+# Função para identificar o upload pelo hash do conteúdo, calculado uma vez por arquivo
+def upload_id(file_data):
+    if st.session_state.get('arquivo_id') != file_data.file_id:
+        st.session_state['dataset_id'] = REGISTRY.dataset_id(file_data)
+        st.session_state['arquivo_id'] = file_data.file_id
+    # Mantém a base no cache compartilhado enquanto alguma sessão a estiver usando
+    use_dataset(st.session_state['dataset_id'])
+    return st.session_state['dataset_id']
+
+# Função para ler os dados uma vez por conteúdo, em blocos e com barra de progresso
+def load_data(file_data, dataset_id, preview):
+    return REGISTRY.get_or_create((dataset_id, 'dados'), read_upload, file_data, dataset_id, preview,
+                                  fixar = True)
+
+# Função para abrir a base do cache em disco (Arrow mapeado em memória, vale
+# também depois de reiniciar o processo) ou ler o upload na primeira vez. As
+# listas dos widgets só são montadas da base inteira quando ela vem do disco.
+def read_upload(file_data, dataset_id, preview):
+    bank = DISK_CACHE.load(dataset_id, 'dados')
+    if bank is not None:
+        return bank, memory_report(bank), widget_values(bank)
+    bank, valores_unicos = stream_upload(file_data, preview)
+    DISK_CACHE.store(dataset_id, 'dados', bank)
+    return bank, memory_report(bank), valores_unicos
+
+# Função para ler o arquivo com o leitor do seu formato e tipos compactos
+def stream_upload(file_data, preview):
+    progresso = st.sidebar.progress(0.0, text='Lendo arquivo...')
+
+    def on_chunk(chunk, linhas, fracao):
+        if linhas == len(chunk):
+            preview.write(chunk.head())
+        progresso.progress(fracao, text=f'{linhas:,} linhas lidas')
 
-# Set no tema do seaborn para melhorar o visual dos plots
-custom_params = {"axes.spines.right": False, "axes.spines.top": False}
-sns.set_theme(style="ticks", rc=custom_params)
-
-
-# Função para ler os dados
-@st.cache(show_spinner= True, allow_output_mutation=True)
-def load_data(file_data):
     try:
-        return pd.read_csv(file_data, sep=';')
-    except:
-        return pd.read_excel(file_data)
-
-# Função para filtrar baseado na multiseleção de categorias
-@st.cache(allow_output_mutation=True)
-def multiselect_filter(relatorio, col, selecionados):
-    if 'all' in selecionados:
-        return relatorio
-    else:
-        return relatorio[relatorio[col].isin(selecionados)].reset_index(drop=True)
+        return stream_bank_data(file_data, file_data.name, on_chunk=on_chunk)
+    finally:
+        progresso.empty()
+
+# Função para montar a tabela de proporção (%) da variável resposta
+def target_perc(proporcao):
+    perc = proporcao.to_frame()*100
+    return perc.sort_index()
 
 # Função para converter o df para csv
-@st.cache
 def convert_df(df):
     return df.to_csv(index=False).encode('utf-8')
 
-# Função para converter o df para excel
-@st.cache
-def to_excel(df):
-    output = BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    df.to_excel(writer, index=False, sheet_name='Sheet1')
-    writer.save()
-    processed_data = output.getvalue()
-    return processed_data
+# Função para gerar o arquivo da base filtrada, materializando-a só aqui
+def filtered_export(filter_index, df, idades, selecoes, formato):
+    return export_bytes(filter_index.view(df, idades, selecoes), formato)
+
+
+# Função para desenhar os gráficos de proporção e devolver o PNG
+def plot_target(bank_raw_target_perc, bank_target_perc, graph_type):
+    # seaborn (com o tema dos apps) e matplotlib são importados só no primeiro gráfico
+    sns, plt = plotting()
+    fig, ax = plt.subplots(1, 2, figsize = (5,3))
+
+    if graph_type == 'Barras':
+        sns.barplot(x = bank_raw_target_perc.index, 
+                    y = 'y',
+                    data = bank_raw_target_perc, 
+                    ax = ax[0])
+        ax[0].bar_label(ax[0].containers[0])
+        ax[0].set_title('Dados brutos',
+                        fontweight ="bold")
+        
+        sns.barplot(x = bank_target_perc.index, 
+                    y = 'y', 
+                    data = bank_target_perc, 
+                    ax = ax[1])
+        # Filtro sem linhas: a tabela vem vazia e não há barras para rotular
+        if ax[1].containers:
+            ax[1].bar_label(ax[1].containers[0])
+        ax[1].set_title('Dados filtrados',
+                        fontweight ="bold")
+    else:
+        bank_raw_target_perc.plot(kind='pie', autopct='%.2f', y='proportion', ax = ax[0])
+        ax[0].set_title('Dados brutos',
+                        fontweight ="bold")
+        
+        bank_target_perc.plot(kind='pie', autopct='%.2f', y='proportion', ax = ax[1])
+        ax[1].set_title('Dados filtrados',
+                        fontweight ="bold")
 
+    return figure_png(fig)
 
 # Função principal da aplicação
 def main():
     # Configuração inicial da página da aplicação
     st.set_page_config(page_title = 'Telemarketing analisys', \
-        page_icon = 'telmarketing_icon.png',
+        page_icon = static_asset('telmarketing_icon.png'),
         layout="wide",
         initial_sidebar_state='expanded'
     )
@@ -57,21 +123,47 @@ def main():
     st.write('# Telemarketing analisys')
     st.markdown("---")
     
-    # Apresenta a imagem na barra lateral da aplicação
-    image = Image.open("Bank-Branding.jpg")
-    st.sidebar.image(image)
+    # Apresenta a imagem na barra lateral da aplicação (lida uma vez por processo)
+    st.sidebar.image(static_asset("Bank-Branding.jpg"))
 
     # Botão para carregar arquivo na aplicação
     st.sidebar.write("## Suba o arquivo")
-    data_file_1 = st.sidebar.file_uploader("Bank marketing data", type = ['csv','xlsx'])
+    data_file_1 = st.sidebar.file_uploader("Bank marketing data", type = ['csv','xlsx','parquet','feather','arrow'])
 
     # Verifica se há conteúdo carregado na aplicação
     if (data_file_1 is not None):
-        bank_raw = load_data(data_file_1)
-        bank = bank_raw.copy()
-
         st.write('## Antes dos filtros')
-        st.write(bank_raw.head())
+        preview = st.empty()
+
+        dataset_id = upload_id(data_file_1)
+        try:
+            with stage('carga'):
+                if duckdb_enabled():
+                    dados = REGISTRY.get_or_create((dataset_id, 'duckdb'), open_upload,
+                                                   data_file_1, dataset_id, data_file_1.name, fixar = True)
+                else:
+                    bank_raw, memoria, valores_unicos = load_data(data_file_1, dataset_id, preview)
+        except (IngestLimitError, UnsupportedFormatError) as erro:
+            st.error(str(erro))
+            st.stop()
+
+        if duckdb_enabled():
+            # Base em Parquet no disco: filtros e proporções rodam em SQL no DuckDB
+            bank_raw = None
+            filter_index = cube = dados
+            with stage('indices'):
+                valores_unicos = REGISTRY.get_or_create((dataset_id, 'valores'), dados.widget_values, fixar = True)
+                min_age, max_age = REGISTRY.get_or_create((dataset_id, 'idades'), dados.value_range, 'age', fixar = True)
+            st.sidebar.write(f"Base em disco: {format_bytes(dados.file_size)} ({dados.n_rows:,} linhas)")
+        else:
+            st.sidebar.write(f"Memória: {format_bytes(memoria['memoria_atual'])} "
+                             f"(economia de {format_bytes(memoria['economia'])})")
+            with stage('indices'):
+                filter_index = REGISTRY.get_or_create((dataset_id, 'indice'), FilterIndex, bank_raw, fixar = True)
+                cube = REGISTRY.get_or_create((dataset_id, 'cubo'), TargetCube, bank_raw, fixar = True)
+            min_age, max_age = bank_raw.age.min(), bank_raw.age.max()
+
+        preview.write(filter_index.head(bank_raw))
 
         with st.sidebar.form(key='my_form'):
 
@@ -79,150 +171,138 @@ def main():
             graph_type = st.radio('Tipo de gráfico:', ('Barras', 'Pizza'))
         
             # IDADES
-            max_age = int(bank.age.max())
-            min_age = int(bank.age.min())
             idades = st.slider(label='Idade', 
-                                        min_value = min_age,
-                                        max_value = max_age, 
-                                        value = (min_age, max_age),
+                                        min_value = int(min_age),
+                                        max_value = int(max_age), 
+                                        value = (int(min_age), int(max_age)),
                                         step = 1)
 
 
             # PROFISSÕES
-            jobs_list = bank.job.unique().tolist()
+            jobs_list = list(valores_unicos['job'])
             jobs_list.append('all')
             jobs_selected =  st.multiselect("Profissão", jobs_list, ['all'])
 
             # ESTADO CIVIL
-            marital_list = bank.marital.unique().tolist()
+            marital_list = list(valores_unicos['marital'])
             marital_list.append('all')
             marital_selected =  st.multiselect("Estado civil", marital_list, ['all'])
 
             # DEFAULT?
-            default_list = bank.default.unique().tolist()
+            default_list = list(valores_unicos['default'])
             default_list.append('all')
             default_selected =  st.multiselect("Default", default_list, ['all'])
 
             
             # TEM FINANCIAMENTO IMOBILIÁRIO?
-            housing_list = bank.housing.unique().tolist()
+            housing_list = list(valores_unicos['housing'])
             housing_list.append('all')
             housing_selected =  st.multiselect("Tem financiamento imob?", housing_list, ['all'])
 
             
             # TEM EMPRÉSTIMO?
-            loan_list = bank.loan.unique().tolist()
+            loan_list = list(valores_unicos['loan'])
             loan_list.append('all')
             loan_selected =  st.multiselect("Tem empréstimo?", loan_list, ['all'])
 
             
             # MEIO DE CONTATO?
-            contact_list = bank.contact.unique().tolist()
+            contact_list = list(valores_unicos['contact'])
             contact_list.append('all')
             contact_selected =  st.multiselect("Meio de contato", contact_list, ['all'])
 
             
             # MÊS DO CONTATO
-            month_list = bank.month.unique().tolist()
+            month_list = list(valores_unicos['month'])
             month_list.append('all')
             month_selected =  st.multiselect("Mês do contato", month_list, ['all'])
 
             
             # DIA DA SEMANA
-            day_of_week_list = bank.day_of_week.unique().tolist()
+            day_of_week_list = list(valores_unicos['day_of_week'])
             day_of_week_list.append('all')
             day_of_week_selected =  st.multiselect("Dia da semana", day_of_week_list, ['all'])
 
 
                     
-            # encadeamento de métodos para filtrar a seleção
-            bank = (bank.query("age >= @idades[0] and age <= @idades[1]")
-                        .pipe(multiselect_filter, 'job', jobs_selected)
-                        .pipe(multiselect_filter, 'marital', marital_selected)
-                        .pipe(multiselect_filter, 'default', default_selected)
-                        .pipe(multiselect_filter, 'housing', housing_selected)
-                        .pipe(multiselect_filter, 'loan', loan_selected)
-                        .pipe(multiselect_filter, 'contact', contact_selected)
-                        .pipe(multiselect_filter, 'month', month_selected)
-                        .pipe(multiselect_filter, 'day_of_week', day_of_week_selected)
-            )
+            # uma única máscara combinando todos os filtros da seleção
+            selecoes = {'job': jobs_selected,
+                        'marital': marital_selected,
+                        'default': default_selected,
+                        'housing': housing_selected,
+                        'loan': loan_selected,
+                        'contact': contact_selected,
+                        'month': month_selected,
+                        'day_of_week': day_of_week_selected}
+            estado = filter_state(idades, selecoes)
 
 
             submit_button = st.form_submit_button(label='Aplicar')
         
         # Botões de download dos dados filtrados
         st.write('## Após os filtros')
-        st.write(bank.head())
+        with stage('filtro'):
+            st.write(filter_index.head(bank_raw, idades, selecoes))
         
-        df_xlsx = to_excel(bank)
-        st.download_button(label='📥 Download tabela filtrada em EXCEL',
-                            data=df_xlsx ,
-                            file_name= 'bank_filtered.xlsx')
+        # Formato dos arquivos de download (Excel, Parquet ou Feather)
+        formato = st.radio('Formato do download', list(EXPORT_FORMATS), horizontal=True,
+                           format_func=lambda f: EXPORT_FORMATS[f][0])
+        nome_formato, mime = EXPORT_FORMATS[formato]
+
+        # Os arquivos só são gerados quando o usuário pede e ficam no cache
+        with stage('download_filtro'):
+            lazy_download_button(st, f'📥 Download tabela filtrada em {nome_formato.upper()}',
+                                 (dataset_id, formato, 'filtro', estado),
+                                 filtered_export, filter_index, bank_raw, idades, selecoes, formato,
+                                 file_name=f'bank_filtered.{formato}',
+                                 mime=mime)
         st.markdown("---")
 
-        # PLOTS    
-        fig, ax = plt.subplots(1, 2, figsize = (5,3))
-
-        bank_raw_target_perc = bank_raw.y.value_counts(normalize = True).to_frame()*100
-        bank_raw_target_perc = bank_raw_target_perc.sort_index()
-        
-        try:
-            bank_target_perc = bank.y.value_counts(normalize = True).to_frame()*100
-            bank_target_perc = bank_target_perc.sort_index()
-        except:
-            st.error('Erro no filtro')
+        # proporções calculadas pela soma das células do cubo, sem varrer a base
+        with stage('proporcoes'):
+            bank_raw_target_perc = target_perc(cube.value_counts(normalize = True))
+            
+            try:
+                bank_target_perc = target_perc(cube.value_counts(idades, selecoes, normalize = True))
+            except:
+                st.error('Erro no filtro')
         
         # Botões de download dos dados dos gráficos
         col1, col2 = st.columns(2)
 
-        df_xlsx = to_excel(bank_raw_target_perc)
         col1.write('### Proporção original')
         col1.write(bank_raw_target_perc)
-        col1.download_button(label='📥 Download',
-                            data=df_xlsx ,
-                            file_name= 'bank_raw_y.xlsx')
+        with stage('download_proporcao'):
+            lazy_download_button(col1, '📥 Download', (dataset_id, formato, 'proporcao'),
+                                 export_bytes, bank_raw_target_perc, formato,
+                                 file_name=f'bank_raw_y.{formato}',
+                                 mime=mime)
         
-        df_xlsx = to_excel(bank_target_perc)
         col2.write('### Proporção da tabela com filtros')
         col2.write(bank_target_perc)
-        col2.download_button(label='📥 Download',
-                            data=df_xlsx ,
-                            file_name= 'bank_y.xlsx')
+        with stage('download_proporcao_filtro'):
+            lazy_download_button(col2, '📥 Download', (dataset_id, formato, 'proporcao', estado),
+                                 export_bytes, bank_target_perc, formato,
+                                 file_name=f'bank_y.{formato}',
+                                 mime=mime)
         st.markdown("---")
     
 
         st.write('## Proporção de aceite')
-        # PLOTS    
-        if graph_type == 'Barras':
-            sns.barplot(x = bank_raw_target_perc.index, 
-                        y = 'y',
-                        data = bank_raw_target_perc, 
-                        ax = ax[0])
-            ax[0].bar_label(ax[0].containers[0])
-            ax[0].set_title('Dados brutos',
-                            fontweight ="bold")
-            
-            sns.barplot(x = bank_target_perc.index, 
-                        y = 'y', 
-                        data = bank_target_perc, 
-                        ax = ax[1])
-            ax[1].bar_label(ax[1].containers[0])
-            ax[1].set_title('Dados filtrados',
-                            fontweight ="bold")
-        else:
-            bank_raw_target_perc.plot(kind='pie', autopct='%.2f', y='y', ax = ax[0])
-            ax[0].set_title('Dados brutos',
-                            fontweight ="bold")
-            
-            bank_target_perc.plot(kind='pie', autopct='%.2f', y='y', ax = ax[1])
-            ax[1].set_title('Dados filtrados',
-                            fontweight ="bold")
-
-        st.pyplot(plt)
+        # PLOTS: o PNG fica no cache por base, tipo de gráfico e filtros
+        with stage('grafico'):
+            grafico = REGISTRY.get_or_create((dataset_id, 'grafico', graph_type, estado),
+                                             plot_target, bank_raw_target_perc, bank_target_perc, graph_type)
+        st.image(grafico, use_container_width=True)
 
 
 if __name__ == '__main__':
-	main()
+	# Registro de tempo, cache e memória de cada etapa no log de desempenho
+	with PerfRecorder('app_7', st.session_state.setdefault('sessao_id', uuid.uuid4().hex[:8])) as perf:
+		main()
+		if PERF_PANEL:
+			perf_panel(perf, st.sidebar)
+		after_first_paint(perf)
     
 
 
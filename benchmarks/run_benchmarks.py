@@ -0,0 +1,252 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from synthetic_data import write_bank_csv, write_purchases_csv
+from clustering import cluster_rfv, default_method
+from data_loader import stream_bank_data, read_table
+from export import export_bytes, EXCEL_MAX_ROWS
+from filter_index import FilterIndex
+from rfv import rfv_table, quantile_edges, rfv_segments, RFV_COLUMNS
+from target_cube import TargetCube
+
+TAMANHOS = [10_000, 1_000_000, 10_000_000]
+RESULTADOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# Filtro típico da barra lateral usado nas etapas de filtro e proporção
+IDADES = (25, 60)
+SELECOES = {'job': ['admin.', 'blue-collar', 'technician'],
+            'month': ['may', 'jun', 'jul']}
+# Apps medidos na partida a frio e módulos cujo tempo de importação é acompanhado
+APPS = ['MOD19_Streamlit2_BrunoPeixoto.py', 'app_7.py',
+        'MOD31_Streamlit1_BrunoPeixoto.py', 'MOD31_Streamlit2_BrunoPeixoto.py']
+MODULOS_PARTIDA = ['pandas', 'streamlit', 'pyarrow', 'duckdb', 'openpyxl',
+                   'matplotlib.pyplot', 'seaborn', 'sklearn']
+
+
+# Tempo acumulado de importação (s) de cada módulo na saída do -X importtime.
+# Cada módulo é importado uma vez por processo, então aparece uma única vez,
+# no primeiro nível ou dentro de quem o importou.
+def import_times(saida):
+    tempos = {}
+    for linha in saida.splitlines():
+        if linha.startswith('import time:') and linha.count('|') == 2:
+            _, acumulado, nome = linha.split('|')
+            if acumulado.strip().isdigit():
+                tempos[nome.strip()] = int(acumulado) / 1e6
+    return tempos
+
+
+# Memória residente do processo (None sem o psutil)
+def rss():
+    return psutil.Process().memory_info().rss if psutil is not None else None
+
+
+class Medicao:
+    """Mede o tempo e o pico de memória residente de um trecho de código.
+
+    Uma thread amostra o RSS a cada poucos milissegundos; o pico é reportado
+    em relação ao RSS do início, então inclui a memória do pandas, do numpy
+    e do pyarrow, que o tracemalloc não enxerga por completo.
+    """
+
+    INTERVALO = 0.005
+
+    def __enter__(self):
+        self.inicio_rss = self.pico_rss = rss()
+        self._parar = threading.Event()
+        if self.inicio_rss is not None:
+            self._thread = threading.Thread(target=self._amostrar, daemon=True)
+            self._thread.start()
+        self._inicio = time.perf_counter()
+        return self
+
+    def _amostrar(self):
+        while not self._parar.wait(self.INTERVALO):
+            self.pico_rss = max(self.pico_rss, rss())
+
+    def __exit__(self, *exc):
+        self.segundos = time.perf_counter() - self._inicio
+        self._parar.set()
+        if self.inicio_rss is not None:
+            self._thread.join()
+            self.pico_rss = max(self.pico_rss, rss())
+        return False
+
+    @property
+    def pico_mb(self):
+        if self.inicio_rss is None:
+            return None
+        return (self.pico_rss - self.inicio_rss) / 1024 ** 2
+
+
+class Benchmark:
+    def __init__(self, max_linhas_excel=EXCEL_MAX_ROWS - 1):
+        self.max_linhas_excel = max_linhas_excel
+        self.resultados = []
+
+    # Executa func(*args) medindo tempo e memória; retorna o resultado da função
+    def etapa(self, base, linhas, nome, func, *args):
+        with Medicao() as medicao:
+            resultado = func(*args)
+        self.resultados.append({'base': base, 'linhas': linhas, 'etapa': nome,
+                                'segundos': round(medicao.segundos, 4),
+                                'pico_memoria_mb': None if medicao.pico_mb is None
+                                else round(medicao.pico_mb, 1)})
+        print(f'{base:8} {linhas:>11,} {nome:20} {medicao.segundos:9.3f}s', flush=True)
+        return resultado
+
+    def pular(self, base, linhas, nome):
+        self.resultados.append({'base': base, 'linhas': linhas, 'etapa': nome,
+                                'segundos': None, 'pico_memoria_mb': None, 'pulado': True})
+        print(f'{base:8} {linhas:>11,} {nome:20}   (pulado)', flush=True)
+
+    def exportar(self, base, linhas, df):
+        if len(df) <= self.max_linhas_excel:
+            self.etapa(base, linhas, 'export_xlsx', export_bytes, df, 'xlsx')
+        else:
+            self.pular(base, linhas, 'export_xlsx')
+        self.etapa(base, linhas, 'export_parquet', export_bytes, df, 'parquet')
+
+    # Partida a frio do app num processo novo, no modo bare do Streamlit (sem
+    # upload): tempo até a primeira página e importação dos módulos pesados
+    # que ainda são carregados nela
+    def partida(self, app):
+        comando = [sys.executable, '-X', 'importtime', os.path.join(RAIZ, app)]
+        ambiente_app = dict(os.environ, PERF_LOG_PATH='')
+        processo = self.etapa('partida', 0, app, lambda: subprocess.run(
+            comando, capture_output=True, text=True, cwd=RAIZ, env=ambiente_app))
+        tempos = import_times(processo.stderr)
+        for modulo in MODULOS_PARTIDA:
+            if modulo in tempos:
+                self.resultados.append({'base': 'partida', 'linhas': 0,
+                                        'etapa': f'{app}:import {modulo}',
+                                        'segundos': round(tempos[modulo], 4),
+                                        'pico_memoria_mb': None})
+
+    # Carga, filtros, proporções e exportação da base de telemarketing
+    def bank(self, caminho, linhas):
+        with open(caminho, 'rb') as arquivo:
+            df, _ = self.etapa('bank', linhas, 'carga', stream_bank_data, arquivo, caminho)
+        indice = self.etapa('bank', linhas, 'indice_filtros', FilterIndex, df)
+        filtrado = self.etapa('bank', linhas, 'filtro', indice.apply, df, IDADES, SELECOES)
+        cubo = self.etapa('bank', linhas, 'cubo', TargetCube, df)
+        self.etapa('bank', linhas, 'proporcoes', cubo.value_counts, IDADES, SELECOES, True)
+        self.etapa('bank', linhas, 'value_counts_pandas',
+                   lambda: filtrado['y'].value_counts(normalize=True))
+        self.exportar('bank', linhas, filtrado)
+
+    # Carga, tabela RFV, classificação, KMeans e exportação da base de compras
+    def compras(self, caminho, linhas):
+        with open(caminho, 'rb') as arquivo:
+            df = self.etapa('compras', linhas, 'carga', read_table, arquivo, caminho, ['DiaCompra'])
+        df_rfv = self.etapa('compras', linhas, 'rfv', rfv_table, df)[RFV_COLUMNS].copy()
+        self.etapa('compras', linhas, 'classificacao',
+                   lambda: rfv_segments(df_rfv, quantile_edges(df_rfv)))
+        metodo = default_method(len(df_rfv))
+        self.etapa('compras', linhas, f'cluster_{metodo}', cluster_rfv, df_rfv, 4, metodo)
+        self.exportar('compras', linhas, df_rfv)
+
+
+def ambiente():
+    versoes = {'python': platform.python_version(), 'numpy': np.__version__,
+               'pandas': pd.__version__, 'sklearn': sklearn.__version__}
+    try:
+        import pyarrow
+        versoes['pyarrow'] = pyarrow.__version__
+    except ImportError:
+        pass
+    return {'plataforma': platform.platform(), 'cpus': os.cpu_count(), 'versoes': versoes}
+
+
+# Compara dois arquivos de resultados; retorna as etapas que ficaram mais
+# lentas que o limite (razão novo/anterior). Etapas abaixo de min_segundos nas
+# duas execuções são só ruído e não contam como regressão.
+def compare(anterior, atual, limite=1.2, min_segundos=0.05):
+    def indexar(resultados):
+        return {(r['base'], r['linhas'], r['etapa']): r['segundos'] for r in resultados
+                if r.get('segundos')}
+
+    antes, depois = indexar(anterior['resultados']), indexar(atual['resultados'])
+    linhas = []
+    for chave in sorted(antes.keys() & depois.keys()):
+        razao = depois[chave] / antes[chave]
+        linhas.append((*chave, antes[chave], depois[chave], razao))
+    tabela = pd.DataFrame(linhas, columns=['base', 'linhas', 'etapa', 'anterior_s', 'atual_s', 'razao'])
+    lentas = (tabela['razao'] > limite) & (tabela[['anterior_s', 'atual_s']].max(axis=1) >= min_segundos)
+    return tabela, tabela[lentas]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks das etapas dos apps com bases sintéticas.')
+    parser.add_argument('--linhas', type=int, nargs='+', default=TAMANHOS)
+    parser.add_argument('--bases', nargs='+', choices=['partida', 'bank', 'compras'],
+                        default=['partida', 'bank', 'compras'])
+    parser.add_argument('--saida', help='arquivo JSON dos resultados (padrão: benchmarks/results/<data>.json)')
+    parser.add_argument('--dados', help='pasta para guardar e reaproveitar as bases geradas')
+    parser.add_argument('--max-linhas-excel', type=int, default=EXCEL_MAX_ROWS - 1,
+                        help='acima disso a exportação em xlsx é pulada')
+    parser.add_argument('--comparar', help='resultados anteriores (JSON) para checar regressões')
+    parser.add_argument('--limite', type=float, default=1.2,
+                        help='razão de tempo acima da qual a etapa é uma regressão')
+    args = parser.parse_args(argv)
+
+    if psutil is None:
+        print('psutil não instalado: o pico de memória não será medido.', file=sys.stderr)
+
+    benchmark = Benchmark(args.max_linhas_excel)
+    geradores = {'bank': (write_bank_csv, benchmark.bank),
+                 'compras': (write_purchases_csv, benchmark.compras)}
+    if 'partida' in args.bases:
+        for app in APPS:
+            benchmark.partida(app)
+    with tempfile.TemporaryDirectory() as temporaria:
+        pasta = args.dados or temporaria
+        os.makedirs(pasta, exist_ok=True)
+        for linhas in args.linhas:
+            for base in [b for b in args.bases if b in geradores]:
+                gerar, medir = geradores[base]
+                caminho = os.path.join(pasta, f'{base}_{linhas}.csv')
+                if not os.path.exists(caminho):
+                    gerar(caminho, linhas)
+                medir(caminho, linhas)
+
+    resultado = {'data': datetime.datetime.now().isoformat(timespec='seconds'),
+                 'ambiente': ambiente(), 'resultados': benchmark.resultados}
+    saida = args.saida or os.path.join(
+        RESULTADOS, datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, 'w') as arquivo:
+        json.dump(resultado, arquivo, indent=2)
+    print(f'Resultados gravados em {saida}')
+
+    if args.comparar:
+        with open(args.comparar) as arquivo:
+            tabela, regressoes = compare(json.load(arquivo), resultado, args.limite)
+        print(tabela.to_string(index=False))
+        if len(regressoes):
+            print(f'{len(regressoes)} etapa(s) mais lentas que {args.limite}x o anterior.')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
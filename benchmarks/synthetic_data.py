@@ -0,0 +1,63 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BANK_CSV = os.path.join(RAIZ, 'bank-additional.csv')
+BLOCO = 500_000
+
+
+# Base no layout bank-additional com n linhas, sorteadas com reposição da base
+# original (mantém as combinações reais de valores) e com idade e duração
+# perturbadas para não serem só cópias. Gravada em CSV com ';' e textos entre aspas.
+def write_bank_csv(caminho, n_linhas, random_state=42, origem=BANK_CSV):
+    base = pd.read_csv(origem, sep=';')
+    rng = np.random.default_rng(random_state)
+    with open(caminho, 'w', newline='') as arquivo:
+        for inicio in range(0, n_linhas, BLOCO):
+            tamanho = min(BLOCO, n_linhas - inicio)
+            bloco = base.iloc[rng.integers(0, len(base), tamanho)].reset_index(drop=True)
+            bloco['age'] = np.clip(bloco['age'] + rng.integers(-3, 4, tamanho), 17, 98)
+            bloco['duration'] = rng.gamma(1.5, 170, tamanho).astype(np.int64)
+            bloco.to_csv(arquivo, sep=';', index=False, header=inicio == 0,
+                         quoting=csv.QUOTE_NONNUMERIC)
+    return caminho
+
+
+# Base de compras do RFV (ID_cliente, CodigoCompra, DiaCompra, ValorTotal) com
+# n compras ao longo de um ano, cerca de 10 compras por cliente
+def write_purchases_csv(caminho, n_linhas, random_state=42, ano=2021):
+    rng = np.random.default_rng(random_state)
+    n_clientes = max(n_linhas // 10, 100)
+    inicio_ano = np.datetime64(f'{ano}-01-01')
+    with open(caminho, 'w', newline='') as arquivo:
+        for inicio in range(0, n_linhas, BLOCO):
+            tamanho = min(BLOCO, n_linhas - inicio)
+            bloco = pd.DataFrame({
+                # alguns clientes compram bem mais que outros
+                'ID_cliente': (rng.pareto(1.5, tamanho) * n_clientes / 10).astype(np.int64) % n_clientes + 1,
+                'CodigoCompra': np.arange(inicio, inicio + tamanho) + 1000,
+                'DiaCompra': inicio_ano + rng.integers(0, 365, tamanho).astype('timedelta64[D]'),
+                'ValorTotal': rng.gamma(2.0, 800.0, tamanho).round(2),
+            })
+            bloco.to_csv(arquivo, index=False, header=inicio == 0)
+    return caminho
+
+
+GERADORES = {'bank': write_bank_csv, 'compras': write_purchases_csv}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Gera bases sintéticas para os benchmarks.')
+    parser.add_argument('base', choices=list(GERADORES))
+    parser.add_argument('linhas', type=int)
+    parser.add_argument('saida')
+    args = parser.parse_args(argv)
+    GERADORES[args.base](args.saida, args.linhas)
+
+
+if __name__ == '__main__':
+    main()
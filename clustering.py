@@ -0,0 +1,134 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from rfv import RFV_COLUMNS
+from startup import lazy_import
+
+# O sklearn (e o joblib) só é importado quando um agrupamento é pedido: a
+# importação leva segundos e atrasaria a primeira página dos apps
+
+# Modo MiniBatch: o modelo é ajustado numa amostra dos clientes e depois todos
+# são atribuídos ao cluster mais próximo em blocos de linhas
+CLUSTER_SAMPLE_ROWS = int(os.environ.get('CLUSTER_SAMPLE_ROWS', 100_000))
+PREDICT_BATCH_ROWS = int(os.environ.get('PREDICT_BATCH_ROWS', 100_000))
+MINIBATCH_SIZE = 4096
+
+# Varredura de K: todos os valores do slider são ajustados uma vez por base,
+# em paralelo; a silhueta é calculada numa amostra (ela é O(n²))
+K_RANGE = range(2, 11)
+SILHOUETTE_SAMPLE_ROWS = int(os.environ.get('SILHOUETTE_SAMPLE_ROWS', 10_000))
+SWEEP_JOBS = int(os.environ.get('CLUSTER_SWEEP_JOBS', -1))
+
+# Métodos de agrupamento disponíveis nos apps: chave -> nome
+CLUSTER_METHODS = {
+    'kmeans': 'KMeans (base completa)',
+    'minibatch': 'MiniBatchKMeans (amostra)',
+}
+
+
+# Método sugerido para o tamanho da base
+def default_method(n_linhas):
+    return 'minibatch' if n_linhas > CLUSTER_SAMPLE_ROWS else 'kmeans'
+
+
+# Linhas da amostra de ajuste (todas, se a base couber na amostra)
+def sample_rows(n_linhas, n_amostra=CLUSTER_SAMPLE_ROWS, random_state=42):
+    if n_linhas <= n_amostra:
+        return np.arange(n_linhas)
+    rng = np.random.default_rng(random_state)
+    return np.sort(rng.choice(n_linhas, size=n_amostra, replace=False))
+
+
+# Colunas do RFV normalizadas (média 0, desvio 1), transformadas no lugar
+def scaled_matrix(df_RFV, columns=RFV_COLUMNS, dtype=np.float64):
+    X = df_RFV[columns].to_numpy(dtype=dtype)
+    scaler = lazy_import('sklearn.preprocessing').StandardScaler(copy=False).fit(X)
+    return scaler.transform(X), scaler
+
+
+# Cluster de cada linha e inércia total, calculados em blocos de linhas
+def assign_batched(modelo, X, batch_rows=PREDICT_BATCH_ROWS):
+    labels = np.empty(len(X), dtype=np.int32)
+    inercia = 0.0
+    for inicio in range(0, len(X), batch_rows):
+        bloco = X[inicio:inicio + batch_rows]
+        rotulos = modelo.predict(bloco)
+        labels[inicio:inicio + batch_rows] = rotulos
+        inercia += float(((bloco - modelo.cluster_centers_[rotulos]) ** 2).sum())
+    return labels, inercia
+
+
+# Ajusta o modelo na matriz já normalizada. Retorna (labels, modelo, inercia).
+def fit_clusters(X, n_clusters, metodo='kmeans', n_amostra=CLUSTER_SAMPLE_ROWS,
+                 batch_rows=PREDICT_BATCH_ROWS, random_state=42):
+    cluster = lazy_import('sklearn.cluster')
+    if metodo == 'kmeans':
+        modelo = cluster.KMeans(n_clusters=n_clusters, random_state=random_state, n_init='auto').fit(X)
+        return modelo.labels_.astype(np.int32), modelo, float(modelo.inertia_)
+
+    modelo = cluster.MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state,
+                                     batch_size=MINIBATCH_SIZE, n_init='auto')
+    modelo.fit(X[sample_rows(len(X), n_amostra, random_state)])
+    labels, inercia = assign_batched(modelo, X, batch_rows)
+    return labels, modelo, inercia
+
+
+def _check_method(metodo):
+    if metodo not in CLUSTER_METHODS:
+        raise ValueError(f'Método de agrupamento desconhecido: {metodo}')
+    # o MiniBatch trabalha em float32 para reduzir a memória
+    return np.float64 if metodo == 'kmeans' else np.float32
+
+
+# Agrupa os clientes pelas colunas do RFV normalizadas. 'kmeans' ajusta o
+# KMeans na base completa; 'minibatch' ajusta um MiniBatchKMeans numa amostra
+# e atribui todos os clientes em blocos. Retorna (labels, modelo, scaler).
+def cluster_rfv(df_RFV, n_clusters, metodo='kmeans', columns=RFV_COLUMNS,
+                n_amostra=CLUSTER_SAMPLE_ROWS, batch_rows=PREDICT_BATCH_ROWS, random_state=42):
+    X, scaler = scaled_matrix(df_RFV, columns, _check_method(metodo))
+    labels, modelo, _ = fit_clusters(X, n_clusters, metodo, n_amostra, batch_rows, random_state)
+    return labels, modelo, scaler
+
+
+def _sweep_k(X, n_clusters, metodo, n_amostra, batch_rows, random_state, amostra_silhueta):
+    labels, modelo, inercia = fit_clusters(X, n_clusters, metodo, n_amostra, batch_rows, random_state)
+    rotulos_amostra = labels[amostra_silhueta]
+    if len(np.unique(rotulos_amostra)) > 1:
+        metrics = lazy_import('sklearn.metrics')
+        silhueta = float(metrics.silhouette_score(X[amostra_silhueta], rotulos_amostra))
+    else:
+        silhueta = np.nan
+    return {'labels': labels.astype(np.int8),
+            'centroides': modelo.cluster_centers_,
+            'inercia': inercia,
+            'silhueta': silhueta}
+
+
+# Ajusta todos os K de k_range de uma vez, em paralelo entre os núcleos (a
+# matriz normalizada é compartilhada com os processos via memmap do joblib).
+# Retorna {K: {'labels', 'centroides' (na escala original), 'inercia', 'silhueta'}}.
+def cluster_sweep(df_RFV, k_range=K_RANGE, metodo='kmeans', columns=RFV_COLUMNS,
+                  n_amostra=CLUSTER_SAMPLE_ROWS, batch_rows=PREDICT_BATCH_ROWS,
+                  n_silhueta=SILHOUETTE_SAMPLE_ROWS, n_jobs=SWEEP_JOBS, random_state=42):
+    X, scaler = scaled_matrix(df_RFV, columns, _check_method(metodo))
+    amostra_silhueta = sample_rows(len(X), n_silhueta, random_state)
+    joblib = lazy_import('joblib')
+    resultados = joblib.Parallel(n_jobs=n_jobs)(
+        joblib.delayed(_sweep_k)(X, k, metodo, n_amostra, batch_rows, random_state, amostra_silhueta)
+        for k in k_range)
+
+    varredura = {}
+    for k, resultado in zip(k_range, resultados):
+        resultado['centroides'] = pd.DataFrame(scaler.inverse_transform(resultado['centroides']),
+                                               columns=columns).rename_axis('Cluster')
+        varredura[k] = resultado
+    return varredura
+
+
+# Inércia (cotovelo) e silhueta de cada K da varredura
+def sweep_summary(varredura):
+    return pd.DataFrame({'Inercia': [r['inercia'] for r in varredura.values()],
+                         'Silhueta': [r['silhueta'] for r in varredura.values()]},
+                        index=pd.Index(list(varredura), name='K'))
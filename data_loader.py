@@ -0,0 +1,377 @@
+import csv
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+from filter_index import FILTER_COLUMNS
+
+# Layout da base bank-additional (bank marketing)
+BANK_CATEGORICAL = ['job', 'marital', 'education', 'default', 'housing', 'loan',
+                    'contact', 'month', 'day_of_week', 'poutcome', 'y']
+BANK_INTEGER = ['age', 'duration', 'campaign', 'pdays', 'previous']
+BANK_FLOAT = ['emp.var.rate', 'cons.price.idx', 'cons.conf.idx', 'euribor3m', 'nr.employed']
+BANK_COLUMNS = BANK_CATEGORICAL + BANK_INTEGER + BANK_FLOAT
+
+# Limites da leitura em blocos, configuráveis por variável de ambiente no deploy
+# (0 = sem limite)
+CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 100_000))
+MAX_ROWS = int(os.environ.get('INGEST_MAX_ROWS', 0)) or None
+MAX_MEMORY_MB = int(os.environ.get('INGEST_MAX_MEMORY_MB', 0)) or None
+# teto do bloco em bytes do leitor de CSV do pyarrow
+CHUNK_BYTES = int(os.environ.get('INGEST_CHUNK_MB', 16)) * 1024 ** 2
+
+# Detecção de formato do upload
+SNIFF_BYTES = 64 * 1024
+CSV_DELIMITERS = ';,\t|'
+XLSX_MAGIC = b'PK\x03\x04'
+XLS_MAGIC = b'\xd0\xcf\x11\xe0'
+PARQUET_MAGIC = b'PAR1'
+ARROW_MAGIC = b'ARROW1'
+EXTENSOES_BINARIAS = {'.xlsx': 'xlsx', '.xls': 'xls', '.parquet': 'parquet',
+                      '.feather': 'feather', '.arrow': 'feather'}
+
+
+class IngestLimitError(Exception):
+    pass
+
+
+class UnsupportedFormatError(Exception):
+    pass
+
+
+# Verifica se as colunas lidas seguem o layout da base bank-additional
+def matches_bank_schema(columns):
+    return set(BANK_COLUMNS).issubset(columns)
+
+
+# Reduz colunas numéricas para o menor tipo que comporta os valores
+def downcast_numeric(df, int_cols=None, float_cols=None):
+    if int_cols is None:
+        int_cols = df.select_dtypes(include='integer').columns
+    if float_cols is None:
+        float_cols = df.select_dtypes(include='float').columns
+    for col in int_cols:
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in float_cols:
+        if pd.api.types.is_float_dtype(df[col]):
+            # só reduz para float32 quando nenhum valor muda (ex.: 5228.1 mudaria)
+            reduzida = df[col].astype(np.float32)
+            if np.array_equal(reduzida.to_numpy(np.float64), df[col].to_numpy(), equal_nan=True):
+                df[col] = reduzida
+    return df
+
+
+# Converte um DataFrame já lido (ex.: vindo do Excel) para os tipos compactos
+def compact_bank_frame(df):
+    if not matches_bank_schema(df.columns):
+        return df
+    for col in BANK_CATEGORICAL:
+        if not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return downcast_numeric(df, BANK_INTEGER, BANK_FLOAT)
+
+
+# Tamanho total do arquivo sem alterar a posição de leitura
+def _file_size(file_data):
+    posicao = file_data.tell()
+    file_data.seek(0, os.SEEK_END)
+    tamanho = file_data.tell()
+    file_data.seek(posicao)
+    return tamanho
+
+
+# Junta os blocos unificando as categorias de cada coluna categórica
+def _concat_chunks(chunks):
+    for col in chunks[0].columns:
+        if isinstance(chunks[0][col].dtype, pd.CategoricalDtype):
+            categorias = union_categoricals([c[col] for c in chunks],
+                                            sort_categories=True).categories
+            for chunk in chunks:
+                chunk[col] = chunk[col].cat.set_categories(categorias)
+    if len(chunks) == 1:
+        return chunks[0]
+    return pd.concat(chunks, ignore_index=True)
+
+
+# Detecta o formato do arquivo pelos bytes iniciais, extensão e, para texto,
+# pelo separador mais provável nos primeiros KB. Retorna (formato, separador).
+def detect_format(file_data, name=None):
+    inicio = file_data.read(SNIFF_BYTES)
+    file_data.seek(0)
+
+    if inicio.startswith(XLSX_MAGIC):
+        return 'xlsx', None
+    if inicio.startswith(XLS_MAGIC):
+        return 'xls', None
+    if inicio.startswith(PARQUET_MAGIC):
+        return 'parquet', None
+    if inicio.startswith(ARROW_MAGIC):
+        return 'feather', None
+
+    extensao = os.path.splitext(name or getattr(file_data, 'name', '') or '')[1].lower()
+    if extensao in EXTENSOES_BINARIAS:
+        raise UnsupportedFormatError(
+            f'O arquivo tem extensão {extensao} mas o conteúdo não é um '
+            f'arquivo {EXTENSOES_BINARIAS[extensao]} válido.')
+
+    return 'csv', sniff_delimiter(inicio)
+
+
+# Escolhe o separador do CSV olhando apenas as linhas completas da amostra
+def sniff_delimiter(amostra, default=';'):
+    texto = amostra.decode('utf-8', errors='ignore')
+    if '\n' in texto:
+        texto = texto[:texto.rindex('\n')]
+    try:
+        return csv.Sniffer().sniff(texto, delimiters=CSV_DELIMITERS).delimiter
+    except csv.Error:
+        cabecalho = texto.split('\n', 1)[0]
+        contagem = {sep: cabecalho.count(sep) for sep in CSV_DELIMITERS}
+        sep = max(contagem, key=contagem.get)
+        return sep if contagem[sep] > 0 else default
+
+
+# Blocos do CSV pelo leitor em C do pandas
+def _csv_chunks(file_data, sep, schema, chunksize):
+    tamanho = _file_size(file_data) or 1
+    dtype = {col: 'category' for col in BANK_CATEGORICAL} if schema else None
+    with pd.read_csv(file_data, sep=sep, dtype=dtype, chunksize=chunksize) as leitor:
+        for chunk in leitor:
+            yield chunk, min(file_data.tell() / tamanho, 1.0)
+
+
+# Blocos do CSV pelo leitor multithread do pyarrow. Só é usado quando o layout
+# é conhecido, para que os tipos não dependam da inferência do primeiro bloco.
+# O pyarrow lê por bytes: o bloco é dimensionado para ~chunksize linhas pelo
+# tamanho médio das linhas do início do arquivo (com INGEST_CHUNK_MB como
+# teto) e as linhas lidas são reagrupadas em blocos de chunksize linhas.
+def _arrow_csv_chunks(file_data, sep, chunksize, max_block_size=CHUNK_BYTES):
+    tamanho = _file_size(file_data) or 1
+    inicio = file_data.read(SNIFF_BYTES)
+    file_data.seek(0)
+    linha_media = len(inicio) / max(inicio.count(b'\n'), 1)
+    block_size = int(min(max(chunksize * linha_media, SNIFF_BYTES), max_block_size))
+    tipos = {col: pa.dictionary(pa.int32(), pa.string()) for col in BANK_CATEGORICAL}
+    tipos.update({col: pa.int64() for col in BANK_INTEGER})
+    tipos.update({col: pa.float64() for col in BANK_FLOAT})
+    leitor = pa_csv.open_csv(file_data,
+                             read_options=pa_csv.ReadOptions(block_size=block_size),
+                             parse_options=pa_csv.ParseOptions(delimiter=sep),
+                             convert_options=pa_csv.ConvertOptions(column_types=tipos))
+    # o pyarrow lê o arquivo adiantado, então o progresso é estimado pelos blocos
+    pendentes = pa.Table.from_batches([], leitor.schema)
+    for n_bloco, batch in enumerate(leitor, start=1):
+        pendentes = pa.concat_tables([pendentes, pa.Table.from_batches([batch])])
+        while pendentes.num_rows >= chunksize:
+            yield pendentes.slice(0, chunksize).to_pandas(), min(n_bloco * block_size / tamanho, 1.0)
+            pendentes = pendentes.slice(chunksize)
+    if pendentes.num_rows:
+        yield pendentes.to_pandas(), 1.0
+
+
+# Blocos de uma planilha xlsx lida em modo somente leitura (streaming).
+# Retorna as colunas do cabeçalho e o gerador de blocos.
+def _xlsx_chunks(file_data, chunksize):
+    # importado só quando chega uma planilha, para não atrasar a partida dos apps
+    import openpyxl
+    workbook = openpyxl.load_workbook(file_data, read_only=True, data_only=True)
+    planilha = workbook.worksheets[0]
+    total = planilha.max_row or 0
+    linhas = planilha.iter_rows(values_only=True)
+    colunas = list(next(linhas, ()))
+
+    def blocos():
+        try:
+            bloco = []
+            lidas = 0
+            for linha in linhas:
+                bloco.append(linha)
+                if len(bloco) == chunksize:
+                    lidas += len(bloco)
+                    fracao = min(lidas / total, 1.0) if total else 0.0
+                    yield pd.DataFrame.from_records(bloco, columns=colunas), fracao
+                    bloco = []
+            if bloco:
+                yield pd.DataFrame.from_records(bloco, columns=colunas), 1.0
+        finally:
+            workbook.close()
+
+    return colunas, blocos()
+
+
+# Blocos de um Parquet, lidos grupo a grupo. As categorias gravadas pelo
+# pandas voltam como category.
+def _parquet_chunks(file_data, chunksize):
+    arquivo = pa_parquet.ParquetFile(file_data)
+    total = arquivo.metadata.num_rows or 1
+
+    def blocos():
+        lidas = 0
+        for batch in arquivo.iter_batches(batch_size=chunksize):
+            lidas += batch.num_rows
+            yield batch.to_pandas(), min(lidas / total, 1.0)
+
+    return arquivo.schema_arrow.names, blocos()
+
+
+# Blocos de um arquivo Arrow IPC (Feather v2), um record batch por vez
+def _feather_chunks(file_data):
+    leitor = pa_ipc.open_file(file_data)
+    n_blocos = leitor.num_record_batches
+
+    def blocos():
+        for i in range(n_blocos):
+            yield leitor.get_batch(i).to_pandas(), (i + 1) / n_blocos
+
+    return leitor.schema.names, blocos()
+
+
+# Aplica os tipos compactos a um bloco recém-lido
+def _compact_chunk(chunk, schema):
+    if not schema:
+        return chunk
+    for col in BANK_CATEGORICAL:
+        if not isinstance(chunk[col].dtype, pd.CategoricalDtype):
+            chunk[col] = chunk[col].astype('category')
+    return downcast_numeric(chunk, BANK_INTEGER, BANK_FLOAT)
+
+
+# Lê o upload em blocos, escolhendo o leitor certo já na primeira tentativa
+# e montando a base e as listas de valores únicos dos widgets aos poucos.
+# on_chunk(chunk, linhas_lidas, fracao_lida) é chamado a cada bloco (o primeiro
+# bloco já permite mostrar o head). Passar do limite de linhas ou de memória
+# interrompe a leitura com IngestLimitError.
+def stream_bank_data(file_data, name=None, chunksize=CHUNK_ROWS,
+                     max_rows=MAX_ROWS, max_memory_mb=MAX_MEMORY_MB,
+                     on_chunk=None):
+    formato, sep = detect_format(file_data, name)
+    if formato in ('parquet', 'feather') and pa is None:
+        raise UnsupportedFormatError(f'Leitura de {formato} requer o pacote pyarrow.')
+
+    if formato == 'xls':
+        # formato binário antigo não tem leitor em blocos
+        df = compact_bank_frame(pd.read_excel(file_data))
+        blocos = iter([(df, 1.0)])
+        colunas = list(df.columns)
+    elif formato == 'xlsx':
+        colunas, blocos = _xlsx_chunks(file_data, chunksize)
+    elif formato == 'parquet':
+        colunas, blocos = _parquet_chunks(file_data, chunksize)
+    elif formato == 'feather':
+        colunas, blocos = _feather_chunks(file_data)
+    else:
+        colunas = list(pd.read_csv(file_data, sep=sep, nrows=0).columns)
+        file_data.seek(0)
+        if pa is not None and matches_bank_schema(colunas):
+            blocos = _arrow_csv_chunks(file_data, sep, chunksize)
+        else:
+            blocos = _csv_chunks(file_data, sep, matches_bank_schema(colunas), chunksize)
+
+    schema = matches_bank_schema(colunas)
+    widget_cols = [col for col in FILTER_COLUMNS if col in colunas]
+
+    chunks = []
+    valores_unicos = {col: {} for col in widget_cols}
+    linhas = 0
+    memoria = 0
+
+    for chunk, fracao in blocos:
+        chunk = _compact_chunk(chunk, schema)
+        linhas += len(chunk)
+        memoria += int(chunk.memory_usage(deep=True).sum())
+
+        if max_rows is not None and linhas > max_rows:
+            raise IngestLimitError(
+                f'Arquivo excede o limite de {max_rows:,} linhas.')
+        if max_memory_mb is not None and memoria > max_memory_mb * 1024 ** 2:
+            raise IngestLimitError(
+                f'Arquivo excede o limite de {max_memory_mb:,} MB em memória '
+                f'(lidas {linhas:,} linhas).')
+
+        # dict preserva a ordem de aparição, igual ao unique()
+        for col in widget_cols:
+            valores_unicos[col].update(dict.fromkeys(chunk[col].unique().tolist()))
+
+        chunks.append(chunk)
+        if on_chunk is not None:
+            on_chunk(chunk, linhas, fracao)
+
+    if not chunks:
+        return pd.DataFrame(columns=colunas), {col: [] for col in widget_cols}
+
+    df = _concat_chunks(chunks)
+    return df, {col: list(valores) for col, valores in valores_unicos.items()}
+
+
+# Listas de valores únicos dos widgets a partir de uma base já carregada
+# (mesmo formato do retorno de stream_bank_data)
+def widget_values(df):
+    return {col: df[col].unique().tolist() for col in FILTER_COLUMNS if col in df.columns}
+
+
+# Lê o arquivo inteiro de uma vez com o leitor do seu formato (para bases
+# que não seguem o layout bank-additional, como a de compras do RFV)
+def read_table(file_data, name=None, parse_dates=None):
+    formato, sep = detect_format(file_data, name)
+    if formato in ('parquet', 'feather') and pa is None:
+        raise UnsupportedFormatError(f'Leitura de {formato} requer o pacote pyarrow.')
+
+    if formato == 'parquet':
+        df = pd.read_parquet(file_data)
+    elif formato == 'feather':
+        df = pd.read_feather(file_data)
+    elif formato in ('xlsx', 'xls'):
+        df = pd.read_excel(file_data)
+    else:
+        return pd.read_csv(file_data, sep=sep, parse_dates=parse_dates)
+
+    for col in parse_dates or []:
+        if not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+
+# Memória que o DataFrame ocuparia com colunas object e números de 64 bits
+def uncompacted_memory(df):
+    total = df.index.memory_usage(deep=True)
+    for col in df.columns:
+        serie = df[col]
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            contagem = serie.value_counts(dropna=False)
+            tamanhos = [sys.getsizeof(valor) for valor in contagem.index]
+            # ponteiro de 8 bytes por linha + o objeto de cada valor
+            total += 8 * len(serie) + int((contagem.to_numpy() * tamanhos).sum())
+        elif pd.api.types.is_numeric_dtype(serie):
+            total += 8 * len(serie)
+        else:
+            total += serie.memory_usage(index=False, deep=True)
+    return int(total)
+
+
+# Resumo da memória ocupada e economizada pela leitura compacta
+def memory_report(df):
+    atual = int(df.memory_usage(deep=True).sum())
+    original = uncompacted_memory(df)
+    return {'memoria_original': original,
+            'memoria_atual': atual,
+            'economia': original - atual,
+            'fator': original / atual if atual else 1.0}
+
+
+def format_bytes(n_bytes):
+    for unidade in ['B', 'KB', 'MB', 'GB']:
+        if abs(n_bytes) < 1024 or unidade == 'GB':
+            return f'{n_bytes:.1f} {unidade}' if unidade != 'B' else f'{n_bytes} B'
+        n_bytes /= 1024
@@ -0,0 +1,175 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# Limite de memória do cache compartilhado por todas as sessões do processo
+CACHE_MAX_MB = int(os.environ.get('DATASET_CACHE_MB', 1024))
+HASH_BLOCK = 1024 ** 2
+
+
+# Impressão digital do conteúdo do arquivo, lida em blocos sem carregar tudo
+def fingerprint(file_data):
+    posicao = file_data.tell()
+    file_data.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    for bloco in iter(lambda: file_data.read(HASH_BLOCK), b''):
+        digest.update(bloco)
+    file_data.seek(posicao)
+    return digest.hexdigest()
+
+
+# Estimativa do tamanho em bytes de um artefato guardado no cache
+def sizeof(valor):
+    if isinstance(valor, (bytes, bytearray)):
+        return len(valor)
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(deep=True).sum())
+    if isinstance(valor, pd.Series):
+        return int(valor.memory_usage(deep=True))
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, (tuple, list)):
+        return sys.getsizeof(valor) + sum(sizeof(item) for item in valor)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(sizeof(item) for item in valor.values())
+    if hasattr(valor, 'nbytes'):
+        return int(valor.nbytes)
+    return sys.getsizeof(valor)
+
+
+class DatasetRegistry:
+    """Cache LRU, limitado por memória, de bases carregadas e artefatos derivados.
+
+    Cada upload recebe um ID a partir do hash do seu conteúdo, calculado uma
+    única vez. Os artefatos (base, visões filtradas, bytes do Excel,
+    proporções) ficam sob chaves (dataset_id, nome, *estado), de modo que um
+    rerun nunca precisa calcular o hash de um DataFrame grande.
+
+    O registro é um só por processo: sessões que sobem o mesmo arquivo usam a
+    mesma base. Cada sessão marca a base que está usando (acquire) e os
+    artefatos guardados com fixar=True (a base e as estruturas que cada rerun
+    precisa) não saem pela remoção LRU enquanto a base estiver em uso; os
+    derivados de filtros e formatos seguem o LRU normal.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_MB * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = threading.local()
+        self._refs = Counter()
+        self._sessoes = {}
+
+    def dataset_id(self, file_data):
+        return fingerprint(file_data)
+
+    def __contains__(self, chave):
+        with self._lock:
+            return chave in self._itens
+
+    def get(self, chave, default=None):
+        with self._lock:
+            if chave not in self._itens:
+                return default
+            self._itens.move_to_end(chave)
+            return self._itens[chave][0]
+
+    def put(self, chave, valor, tamanho=None, fixar=False):
+        tamanho = sizeof(valor) if tamanho is None else tamanho
+        with self._lock:
+            # artefatos maiores que o cache inteiro só são guardados se forem a
+            # base fixada de uma sessão (senão cada rerun refaria a leitura);
+            # downloads que não cabem voltam sem ir para o cache
+            if tamanho > self.max_bytes and not (fixar and self._refs[self._dataset_of(chave)] > 0):
+                return valor
+            if chave in self._itens:
+                self.total_bytes -= self._itens.pop(chave)[1]
+            self._itens[chave] = (valor, tamanho, fixar)
+            self.total_bytes += tamanho
+            self._evict_lru()
+        return valor
+
+    # Remove os artefatos usados há mais tempo até caber no limite, pulando os
+    # fixados das bases em uso (o cache pode passar do limite só por causa deles)
+    def _evict_lru(self):
+        for chave, (_, _, fixado) in list(self._itens.items()):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if fixado and self._refs[self._dataset_of(chave)] > 0:
+                continue
+            self.total_bytes -= self._itens.pop(chave)[1]
+
+    @staticmethod
+    def _dataset_of(chave):
+        return chave[0] if isinstance(chave, tuple) and chave else chave
+
+    # Marca que a sessão passou a usar a base (a base anterior da sessão é liberada)
+    def acquire(self, dataset_id, sessao):
+        with self._lock:
+            anterior = self._sessoes.get(sessao)
+            if anterior == dataset_id:
+                return
+            if anterior is not None:
+                self._release(sessao)
+            self._sessoes[sessao] = dataset_id
+            self._refs[dataset_id] += 1
+
+    def release(self, sessao):
+        with self._lock:
+            self._release(sessao)
+            self._evict_lru()
+
+    def _release(self, sessao):
+        dataset_id = self._sessoes.pop(sessao, None)
+        if dataset_id is not None:
+            self._refs[dataset_id] -= 1
+            if self._refs[dataset_id] <= 0:
+                del self._refs[dataset_id]
+
+    # Libera as bases das sessões para as quais ativa(sessao) é falso
+    def release_inactive(self, ativa):
+        with self._lock:
+            for sessao in [s for s in self._sessoes if not ativa(s)]:
+                self._release(sessao)
+            self._evict_lru()
+
+    # Quantas sessões estão usando a base
+    def refcount(self, dataset_id):
+        with self._lock:
+            return self._refs[dataset_id]
+
+    # Acertos e faltas de get_or_create feitos pela thread atual (cada sessão
+    # do Streamlit roda numa thread própria)
+    def thread_stats(self):
+        return getattr(self._thread, 'hits', 0), getattr(self._thread, 'misses', 0)
+
+    # Devolve o artefato da chave ou calcula func(*args) e guarda o resultado
+    # (fixar=True para a base e as estruturas de que a sessão precisa a cada rerun)
+    def get_or_create(self, chave, func, *args, fixar=False, **kwargs):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.hits += 1
+                self._thread.hits = getattr(self._thread, 'hits', 0) + 1
+                return self._itens[chave][0]
+            self.misses += 1
+        self._thread.misses = getattr(self._thread, 'misses', 0) + 1
+        return self.put(chave, func(*args, **kwargs), fixar=fixar)
+
+    # Remove todos os artefatos de uma base
+    def evict(self, dataset_id):
+        with self._lock:
+            for chave in [c for c in self._itens if c[0] == dataset_id]:
+                self.total_bytes -= self._itens.pop(chave)[1]
+
+
+# Registro único por processo, compartilhado entre as sessões do Streamlit
+REGISTRY = DatasetRegistry()
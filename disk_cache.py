@@ -0,0 +1,113 @@
+import glob
+import os
+import threading
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pa = None
+
+# Pasta e tamanho máximo do cache em disco das bases convertidas (0 desliga)
+DISK_CACHE_DIR = os.environ.get('DISK_CACHE_DIR', 'cache_bases')
+DISK_CACHE_MB = int(os.environ.get('DISK_CACHE_MB', 2048))
+
+
+# Apaga os arquivos da pasta usados há mais tempo (pela data de modificação)
+# até o total caber em max_bytes, sem apagar os caminhos de manter. Um arquivo
+# apagado continua válido para quem já o tinha mapeado. Retorna o total.
+def evict_files(pasta, padrao, max_bytes, manter=()):
+    arquivos = []
+    for caminho in glob.glob(os.path.join(pasta, padrao)):
+        try:
+            info = os.stat(caminho)
+        except FileNotFoundError:
+            continue
+        arquivos.append((info.st_mtime, info.st_size, caminho))
+    total = sum(tamanho for _, tamanho, _ in arquivos)
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= max_bytes:
+            break
+        if caminho in manter:
+            continue
+        try:
+            os.remove(caminho)
+        except OSError:
+            continue
+        total -= tamanho
+    return total
+
+
+class DiskCache:
+    """Cache em disco das bases já lidas, em arquivos Arrow IPC sem compressão.
+
+    Cada base fica num arquivo nomeado pelo hash do conteúdo do upload, então
+    sobrevive a reinícios do processo e é compartilhado pelos workers da mesma
+    máquina. A leitura mapeia o arquivo em memória: as colunas numéricas sem
+    nulos apontam direto para as páginas do arquivo (sem cópia), que o sistema
+    operacional divide entre os processos. Passando do limite, os arquivos
+    usados há mais tempo são apagados.
+    """
+
+    def __init__(self, pasta=DISK_CACHE_DIR, max_bytes=DISK_CACHE_MB * 1024 ** 2):
+        self.pasta = pasta
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return pa is not None and self.max_bytes > 0
+
+    def path(self, dataset_id, nome):
+        return os.path.join(self.pasta, f'{dataset_id}-{nome}.arrow')
+
+    # DataFrame mapeado do arquivo, ou None se a base não está no cache
+    def load(self, dataset_id, nome):
+        if not self.enabled:
+            return None
+        caminho = self.path(dataset_id, nome)
+        try:
+            tabela = pa_ipc.open_file(pa.memory_map(caminho)).read_all()
+            # a data de modificação marca o último uso, para a remoção por LRU
+            os.utime(caminho)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        return tabela.to_pandas(split_blocks=True)
+
+    def store(self, dataset_id, nome, df):
+        if not self.enabled:
+            return
+        tabela = pa.Table.from_pandas(df, preserve_index=False)
+        if tabela.nbytes > self.max_bytes:
+            return
+        os.makedirs(self.pasta, exist_ok=True)
+        caminho = self.path(dataset_id, nome)
+        # grava num temporário do processo e troca, para que outro worker
+        # nunca mapeie um arquivo pela metade
+        temporario = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            with pa.OSFile(temporario, 'wb') as destino:
+                with pa_ipc.new_file(destino, tabela.schema) as escritor:
+                    escritor.write_table(tabela)
+            os.replace(temporario, caminho)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        self.evict(manter=caminho)
+
+    # Apaga os arquivos menos usados até o cache caber no limite
+    def evict(self, manter=None):
+        with self._lock:
+            return evict_files(self.pasta, '*.arrow', self.max_bytes, {manter})
+
+    # Base do arquivo da chave ou func(*args), gravada no disco para as próximas cargas
+    def get_or_create(self, dataset_id, nome, func, *args, **kwargs):
+        df = self.load(dataset_id, nome)
+        if df is None:
+            df = func(*args, **kwargs)
+            self.store(dataset_id, nome, df)
+        return df
+
+
+# Cache único por processo; a pasta é compartilhada entre os processos
+DISK_CACHE = DiskCache()
@@ -0,0 +1,18 @@
+import streamlit as st
+
+from dataset_registry import REGISTRY
+
+
+# Botão de download com o arquivo gerado sob demanda. Enquanto os bytes não
+# estão no cache aparece só o botão 'Gerar arquivo'; ao clicar, func(*args)
+# roda uma vez, o resultado fica no cache sob a chave e o botão de download
+# passa a aparecer direto nos próximos reruns. Retorna os bytes ou None.
+def lazy_download_button(container, label, chave, func, *args, file_name, mime):
+    # o botão de download ocupa o mesmo lugar do botão 'Gerar arquivo'
+    espaco = container.empty()
+    if chave not in REGISTRY and not espaco.button('Gerar arquivo', key=f'gerar_{file_name}'):
+        return None
+    with st.spinner('Gerando arquivo...'):
+        dados = REGISTRY.get_or_create(chave, func, *args)
+    espaco.download_button(label=label, data=dados, file_name=file_name, mime=mime)
+    return dados
@@ -0,0 +1,148 @@
+import os
+import tempfile
+
+import xlsxwriter
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as pa_feather
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+from filter_index import FilteredView
+
+# Exportação em blocos: o xlsxwriter em modo constant_memory grava cada linha
+# em disco assim que ela é escrita, e o arquivo final fica num temporário que
+# só vai para o disco quando passa do limite de memória.
+EXPORT_CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', 50_000))
+SPOOL_MAX_MB = int(os.environ.get('EXPORT_SPOOL_MB', 32))
+EXCEL_MAX_ROWS = 1_048_576
+
+# Formatos de download disponíveis nos apps: extensão -> (nome, mimetype)
+EXPORT_FORMATS = {
+    'xlsx': ('Excel', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': ('Parquet', 'application/vnd.apache.parquet'),
+    'feather': ('Feather (Arrow IPC)', 'application/vnd.apache.arrow.file'),
+}
+
+
+# Blocos de linhas de um DataFrame ou de uma FilteredView (montados um a um)
+def _frame_chunks(dados, chunksize):
+    if isinstance(dados, FilteredView):
+        yield from dados.chunks(chunksize)
+        return
+    for inicio in range(0, len(dados), chunksize):
+        yield dados.iloc[inicio:inicio + chunksize]
+
+
+# Blocos do DataFrame já convertidos para valores que o xlsxwriter entende
+# (categorias viram texto e NaN/NaT viram célula vazia)
+def _row_chunks(df, chunksize):
+    for bloco in _frame_chunks(df, chunksize):
+        bloco = bloco.astype(object)
+        bloco = bloco.where(bloco.notna(), None)
+        yield bloco.itertuples(index=False, name=None)
+
+
+# Grava o DataFrame em xlsx no destino (caminho ou arquivo binário) sem montar
+# a planilha inteira em memória. Bases maiores que o limite de linhas do
+# Excel continuam em novas abas (Sheet1_2, Sheet1_3, ...).
+def write_excel(df, destino, sheet_name='Sheet1', index=False, chunksize=EXPORT_CHUNK_ROWS):
+    if index:
+        df = df.reset_index()
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True,
+                                             'default_date_format': 'yyyy-mm-dd hh:mm:ss',
+                                             'remove_timezone': True})
+    negrito = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+    cabecalho = [str(col) for col in df.columns]
+    linhas_por_aba = EXCEL_MAX_ROWS - 1
+
+    planilha = None
+    n_aba = 0
+    linha = linhas_por_aba
+    for bloco in _row_chunks(df, chunksize):
+        for valores in bloco:
+            if linha == linhas_por_aba:
+                n_aba += 1
+                nome = sheet_name if n_aba == 1 else f'{sheet_name}_{n_aba}'
+                planilha = workbook.add_worksheet(nome)
+                planilha.write_row(0, 0, cabecalho, negrito)
+                linha = 0
+            linha += 1
+            planilha.write_row(linha, 0, valores)
+
+    if planilha is None:
+        planilha = workbook.add_worksheet(sheet_name)
+        planilha.write_row(0, 0, cabecalho, negrito)
+    workbook.close()
+
+
+# Arquivo temporário com o xlsx, posicionado no início para leitura
+def excel_file(df, sheet_name='Sheet1', index=False):
+    saida = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MB * 1024 ** 2)
+    write_excel(df, saida, sheet_name=sheet_name, index=index)
+    saida.seek(0)
+    return saida
+
+
+# Bytes do xlsx para o st.download_button, lidos uma única vez do temporário
+def excel_bytes(df, sheet_name='Sheet1', index=False):
+    with excel_file(df, sheet_name=sheet_name, index=index) as saida:
+        return saida.read()
+
+
+# Tabela Arrow do DataFrame; colunas category viram dictionary e voltam como
+# category na leitura. index=None guarda o índice apenas quando ele não é o
+# RangeIndex padrão (ex.: ID_cliente na tabela RFV).
+def _arrow_table(df, index=None):
+    if pa is None:
+        raise ImportError('Exportar em Parquet/Feather requer o pacote pyarrow.')
+    return pa.Table.from_pandas(df, preserve_index=index)
+
+
+# Esquema e tabelas Arrow de uma FilteredView, bloco a bloco, sem montar a
+# base filtrada inteira. O esquema vem da base, igual para todos os blocos.
+def _view_tables(view, chunksize=EXPORT_CHUNK_ROWS):
+    if pa is None:
+        raise ImportError('Exportar em Parquet/Feather requer o pacote pyarrow.')
+    schema = pa.Schema.from_pandas(view.df.head(chunksize), preserve_index=False)
+    tabelas = (pa.Table.from_pandas(bloco, schema=schema, preserve_index=False)
+               for bloco in view.chunks(chunksize))
+    return schema, tabelas
+
+
+def parquet_bytes(df, index=None):
+    saida = pa.BufferOutputStream()
+    if isinstance(df, FilteredView):
+        schema, tabelas = _view_tables(df)
+        with pa_parquet.ParquetWriter(saida, schema, compression='zstd') as escritor:
+            for tabela in tabelas:
+                escritor.write_table(tabela)
+    else:
+        pa_parquet.write_table(_arrow_table(df, index), saida, compression='zstd')
+    return saida.getvalue().to_pybytes()
+
+
+def feather_bytes(df, index=None):
+    saida = pa.BufferOutputStream()
+    if isinstance(df, FilteredView):
+        # Feather v2 é o formato de arquivo Arrow IPC
+        schema, tabelas = _view_tables(df)
+        opcoes = pa_ipc.IpcWriteOptions(compression='lz4')
+        with pa_ipc.new_file(saida, schema, options=opcoes) as escritor:
+            for tabela in tabelas:
+                escritor.write_table(tabela)
+    else:
+        pa_feather.write_feather(_arrow_table(df, index), saida, compression='lz4')
+    return saida.getvalue().to_pybytes()
+
+
+# Bytes do DataFrame (ou FilteredView) no formato escolhido para download
+def export_bytes(df, formato='xlsx'):
+    if formato == 'parquet':
+        return parquet_bytes(df)
+    if formato == 'feather':
+        return feather_bytes(df)
+    return excel_bytes(df)
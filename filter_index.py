@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+
+# Colunas categóricas filtradas pelos multiselects da barra lateral
+FILTER_COLUMNS = ['job', 'marital', 'default', 'housing', 'loan',
+                  'contact', 'month', 'day_of_week']
+
+
+# Chave imutável e independente da ordem de seleção para o estado dos filtros
+def filter_state(idades=None, selecoes=None):
+    idades = tuple(idades) if idades is not None else None
+    selecoes = tuple((col, tuple(sorted(map(str, selecionados))))
+                     for col, selecionados in sorted((selecoes or {}).items()))
+    return idades, selecoes
+
+
+class FilterIndex:
+    """Índice de filtros construído uma única vez por base carregada.
+
+    Para cada coluna categórica guarda um bitmap compactado (np.packbits) por
+    valor distinto, e para a idade um array ordenado para consultas de faixa.
+    Qualquer combinação da barra lateral vira uma única máscara booleana
+    obtida com AND/OR dos bitmaps, e a base é fatiada uma única vez.
+    """
+
+    def __init__(self, df, columns=FILTER_COLUMNS, age_col='age'):
+        self.n_rows = len(df)
+        self.age_col = age_col
+        self.values = {}
+        self.bitmaps = {}
+
+        for col in columns:
+            if col not in df.columns:
+                continue
+            # use_na_sentinel=False mantém NaN como um valor selecionável,
+            # igual ao isin do filtro antigo
+            codes, uniques = pd.factorize(df[col], use_na_sentinel=False)
+            self.values[col] = pd.Index(uniques)
+            self.bitmaps[col] = np.stack(
+                [np.packbits(codes == code) for code in range(len(uniques))])
+
+        if age_col in df.columns:
+            ages = df[age_col].to_numpy()
+            self.age_order = np.argsort(ages, kind='stable')
+            self.sorted_ages = ages[self.age_order]
+        else:
+            self.age_order = None
+            self.sorted_ages = None
+
+    @property
+    def nbytes(self):
+        total = sum(bitmap.nbytes for bitmap in self.bitmaps.values())
+        if self.sorted_ages is not None:
+            total += self.age_order.nbytes + self.sorted_ages.nbytes
+        return total
+
+    # Valores distintos da coluna na ordem de aparição (igual ao unique())
+    def unique_values(self, col):
+        return self.values[col].tolist()
+
+    def _full_bitmap(self):
+        return np.packbits(np.ones(self.n_rows, dtype=bool))
+
+    def _age_bitmap(self, idades):
+        lo = np.searchsorted(self.sorted_ages, idades[0], side='left')
+        hi = np.searchsorted(self.sorted_ages, idades[1], side='right')
+        if lo == 0 and hi == self.n_rows:
+            return None
+        rows = np.zeros(self.n_rows, dtype=bool)
+        rows[self.age_order[lo:hi]] = True
+        return np.packbits(rows)
+
+    def _column_bitmap(self, col, selecionados):
+        if 'all' in selecionados:
+            return None
+        codes = self.values[col].get_indexer(list(selecionados))
+        codes = codes[codes >= 0]
+        if len(codes) == 0:
+            return np.zeros(self.bitmaps[col].shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitmaps[col][codes], axis=0)
+
+    # Máscara booleana da combinação de filtros (None = sem restrição)
+    def mask(self, idades=None, selecoes=None):
+        partes = []
+        if idades is not None and self.sorted_ages is not None:
+            partes.append(self._age_bitmap(idades))
+        for col, selecionados in (selecoes or {}).items():
+            partes.append(self._column_bitmap(col, selecionados))
+        partes = [p for p in partes if p is not None]
+
+        if not partes:
+            return None
+        packed = partes[0] if len(partes) == 1 else np.bitwise_and.reduce(partes, axis=0)
+        return np.unpackbits(packed, count=self.n_rows).astype(bool)
+
+    # Primeiras n linhas da base filtrada, sem materializar o resto
+    def head(self, df, idades=None, selecoes=None, n=5):
+        mask = self.mask(idades, selecoes)
+        if mask is None:
+            return df.head(n)
+        return df.take(np.flatnonzero(mask)[:n]).reset_index(drop=True)
+
+    # Aplica os filtros com uma única fatia final da base
+    def apply(self, df, idades=None, selecoes=None):
+        mask = self.mask(idades, selecoes)
+        if mask is None:
+            return df
+        return df.take(np.flatnonzero(mask)).reset_index(drop=True)
+
+    # Base filtrada como visão: guarda só as posições das linhas
+    def view(self, df, idades=None, selecoes=None):
+        mask = self.mask(idades, selecoes)
+        return FilteredView(df, None if mask is None else np.flatnonzero(mask))
+
+
+class FilteredView:
+    """Linhas filtradas de uma base compartilhada, guardadas como posições.
+
+    A base não é copiada: as linhas só são montadas em blocos na hora de
+    exportar (chunks) ou quando a visão é convertida com to_frame().
+    """
+
+    def __init__(self, df, rows=None):
+        self.df = df
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.df) if self.rows is None else len(self.rows)
+
+    @property
+    def columns(self):
+        return self.df.columns
+
+    @property
+    def nbytes(self):
+        return 0 if self.rows is None else self.rows.nbytes
+
+    def head(self, n=5):
+        return self.to_frame(self.rows[:n] if self.rows is not None else slice(0, n))
+
+    # Blocos de até chunksize linhas, com índice 0..n-1 em cada bloco
+    def chunks(self, chunksize):
+        for inicio in range(0, len(self), chunksize):
+            fim = inicio + chunksize
+            yield self.to_frame(slice(inicio, fim) if self.rows is None else self.rows[inicio:fim])
+
+    def to_frame(self, linhas=None):
+        if linhas is None:
+            linhas = self.rows if self.rows is not None else slice(None)
+        if isinstance(linhas, slice):
+            return self.df.iloc[linhas].reset_index(drop=True)
+        return self.df.take(linhas).reset_index(drop=True)
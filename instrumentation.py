@@ -0,0 +1,136 @@
+import contextlib
+import datetime
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from dataset_registry import REGISTRY
+
+# Log estruturado (uma linha JSON por etapa); vazio desliga o arquivo
+PERF_LOG_PATH = os.environ.get('PERF_LOG_PATH', 'desempenho.jsonl')
+# Mostra o painel de desempenho na barra lateral dos apps
+PERF_PANEL = os.environ.get('PERF_PANEL', '0') == '1'
+
+_log = logging.getLogger('desempenho')
+_log.propagate = False
+_log_lock = threading.Lock()
+_atual = threading.local()
+
+# Tempo da primeira importação de cada módulo adiado (startup.lazy_import)
+IMPORT_TIMES = {}
+
+
+def _logger():
+    with _log_lock:
+        if PERF_LOG_PATH and not _log.handlers:
+            handler = logging.FileHandler(PERF_LOG_PATH, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            _log.addHandler(handler)
+            _log.setLevel(logging.INFO)
+    return _log
+
+
+def _rss():
+    return psutil.Process().memory_info().rss if psutil is not None else None
+
+
+class PerfRecorder:
+    """Registro do tempo de cada etapa de uma execução do app.
+
+    Cada etapa guarda o tempo de parede, os acertos e faltas do cache de
+    bases da própria thread (cada sessão do Streamlit roda numa thread) e a
+    variação da memória residente do processo. Os registros vão para o log
+    estruturado e podem ser mostrados no painel da barra lateral.
+    """
+
+    def __init__(self, app, sessao=None):
+        self.app = app
+        self.sessao = sessao
+        self.registros = []
+
+    @contextlib.contextmanager
+    def stage(self, nome):
+        hits, misses = REGISTRY.thread_stats()
+        rss_inicio = _rss()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            hits_fim, misses_fim = REGISTRY.thread_stats()
+            rss_fim = _rss()
+            self.record(nome, segundos, hits_fim - hits, misses_fim - misses,
+                        None if rss_inicio is None else (rss_fim - rss_inicio) / 1024 ** 2)
+
+    # Registra uma etapa já medida (ex.: o tempo de partida do processo)
+    def record(self, nome, segundos, cache_hits=0, cache_misses=0, rss_delta_mb=None):
+        registro = {
+            'ts': datetime.datetime.now().isoformat(timespec='milliseconds'),
+            'app': self.app,
+            'sessao': self.sessao,
+            'etapa': nome,
+            'segundos': round(segundos, 4),
+            'cache_hits': cache_hits,
+            'cache_misses': cache_misses,
+            'rss_delta_mb': None if rss_delta_mb is None else round(rss_delta_mb, 1),
+        }
+        self.registros.append(registro)
+        if PERF_LOG_PATH:
+            _logger().info(json.dumps(registro, ensure_ascii=False))
+
+    def table(self):
+        colunas = ['etapa', 'segundos', 'cache_hits', 'cache_misses', 'rss_delta_mb']
+        return pd.DataFrame(self.registros, columns=['ts', 'app', 'sessao'] + colunas)[colunas]
+
+    # Torna este o registro ativo da thread, usado por stage() e @timed
+    def __enter__(self):
+        _atual.recorder = self
+        return self
+
+    def __exit__(self, *exc):
+        _atual.recorder = None
+        return False
+
+
+# Etapa no registro ativo da thread (sem registro ativo, não mede nada)
+@contextlib.contextmanager
+def stage(nome):
+    recorder = getattr(_atual, 'recorder', None)
+    if recorder is None:
+        yield
+        return
+    with recorder.stage(nome):
+        yield
+
+
+# Painel com as etapas da execução atual (container: st.sidebar)
+def perf_panel(recorder, container):
+    tabela = recorder.table()
+    painel = container.expander('Desempenho')
+    painel.dataframe(tabela, hide_index=True)
+    painel.caption(f"Total: {tabela['segundos'].sum():.3f} s")
+    if IMPORT_TIMES:
+        importacoes = pd.DataFrame(sorted(IMPORT_TIMES.items()), columns=['modulo', 'segundos'])
+        painel.write('Importações adiadas (neste processo)')
+        painel.dataframe(importacoes, hide_index=True)
+
+
+# Decorador que mede cada chamada da função como uma etapa
+def timed(nome=None):
+    def decorador(func):
+        @functools.wraps(func)
+        def medido(*args, **kwargs):
+            with stage(nome or func.__name__):
+                return func(*args, **kwargs)
+        return medido
+    return decorador
@@ -0,0 +1,66 @@
+import io
+import os
+
+import numpy as np
+
+from startup import plotting
+
+# Acima deste número de pontos os gráficos de dispersão não desenham todos
+# os clientes: usam uma amostra estratificada por cluster ou um hexbin
+SCATTER_MAX_POINTS = int(os.environ.get('SCATTER_MAX_POINTS', 50_000))
+# Mínimo de pontos de cada cluster na amostra, para os grupos pequenos aparecerem
+MIN_POINTS_PER_GROUP = 200
+HEXBIN_GRIDSIZE = 60
+
+# Modos de desenho das bases grandes: chave -> nome
+SCATTER_MODES = {
+    'amostra': 'Amostra por cluster',
+    'densidade': 'Densidade (hexbin)',
+}
+
+
+# PNG da figura com as mesmas opções do st.pyplot; a figura é fechada em seguida
+def figure_png(fig, dpi=200):
+    saida = io.BytesIO()
+    fig.savefig(saida, format='png', dpi=dpi, bbox_inches='tight')
+    _, plt = plotting()
+    plt.close(fig)
+    return saida.getvalue()
+
+
+# Amostra com até n linhas, proporcional ao tamanho de cada grupo
+def stratified_sample(df, coluna, n=SCATTER_MAX_POINTS, min_por_grupo=MIN_POINTS_PER_GROUP,
+                      random_state=42):
+    if len(df) <= n:
+        return df
+    rng = np.random.default_rng(random_state)
+    embaralhado = df.iloc[rng.permutation(len(df))]
+    tamanhos = embaralhado[coluna].value_counts()
+    cotas = np.maximum(np.ceil(tamanhos * n / len(df)), np.minimum(tamanhos, min_por_grupo))
+    posicao = embaralhado.groupby(coluna, observed=True).cumcount().to_numpy()
+    return embaralhado[posicao < embaralhado[coluna].map(cotas).to_numpy()]
+
+
+# Gráfico de dispersão de x por y colorido por hue. Bases pequenas são
+# desenhadas inteiras; as grandes viram uma amostra estratificada por grupo
+# ou um hexbin da densidade com a média de cada grupo marcada.
+def scatter_by_group(df, x, y, hue='Cluster', modo='amostra', max_pontos=SCATTER_MAX_POINTS):
+    sns, plt = plotting()
+    fig, ax = plt.subplots()
+    if len(df) <= max_pontos or modo == 'amostra':
+        pontos = stratified_sample(df, hue, max_pontos)
+        sns.scatterplot(data=pontos, x=x, y=y, hue=hue, palette='tab10', ax=ax)
+        if len(pontos) < len(df):
+            ax.set_title(f'Amostra de {len(pontos)} de {len(df)} clientes', fontsize=9)
+        return fig
+
+    hb = ax.hexbin(df[x], df[y], gridsize=HEXBIN_GRIDSIZE, bins='log', cmap='Greys', mincnt=1)
+    fig.colorbar(hb, ax=ax, label='Clientes (log)')
+    medias = df.groupby(hue, observed=True)[[x, y]].mean()
+    cores = sns.color_palette('tab10', len(medias))
+    for cor, (grupo, media) in zip(cores, medias.iterrows()):
+        ax.scatter(media[x], media[y], color=cor, edgecolor='black', s=80, label=grupo)
+    ax.legend(title=hue)
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    return fig
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import string
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+RFV_COLUMNS = ['Recencia', 'Frequencia', 'Valor']
+# Para a recência quanto menor melhor; para frequência e valor, quanto maior
+MAIOR_MELHOR = {'Recencia': False, 'Frequencia': True, 'Valor': True}
+CLASS_COLUMNS = {'Recencia': 'R_Quartile', 'Frequencia': 'F_Quartile', 'Valor': 'V_Quartile'}
+
+# Arquivo com o estado acumulado por cliente do RFV incremental
+RFV_STORE_PATH = os.environ.get('RFV_STORE_PATH', 'rfv_historico.parquet')
+
+
+# Estado por cliente em uma única passada pelas compras: última compra,
+# quantidade de compras e valor total. Índice: ID_cliente.
+def aggregate_purchases(df_compras):
+    return df_compras.groupby('ID_cliente').agg(DiaUltimaCompra=('DiaCompra', 'max'),
+                                                Frequencia=('CodigoCompra', 'count'),
+                                                Valor=('ValorTotal', 'sum'))
+
+
+# Recência em dias da última compra de cada cliente até dia_atual
+def add_recency(estado, dia_atual):
+    df_RFV = estado.copy()
+    df_RFV.insert(1, 'Recencia', (dia_atual - df_RFV['DiaUltimaCompra']).dt.days)
+    return df_RFV
+
+
+# Tabela RFV por cliente: última compra, recência em dias (em relação a
+# dia_atual, por padrão a última data da base), quantidade de compras e
+# valor total
+def rfv_table(df_compras, dia_atual=None):
+    if dia_atual is None:
+        dia_atual = df_compras['DiaCompra'].max()
+    df_RFV = aggregate_purchases(df_compras)
+    df_RFV.insert(1, 'Recencia', (dia_atual - df_RFV['DiaUltimaCompra']).dt.days)
+    return df_RFV
+
+
+# Letras das classes, da melhor ('A') para a pior
+def class_letters(n_classes):
+    if not 2 <= n_classes <= len(string.ascii_uppercase):
+        raise ValueError(f'n_classes deve estar entre 2 e {len(string.ascii_uppercase)}')
+    return list(string.ascii_uppercase[:n_classes])
+
+
+# Cortes dos quantis de cada componente (n_classes=4 -> quartis 0.25, 0.5, 0.75)
+def quantile_edges(df_RFV, n_classes=4, columns=RFV_COLUMNS):
+    q = [i / n_classes for i in range(1, n_classes)]
+    return df_RFV[columns].quantile(q=q)
+
+
+# Código da classe de cada valor (0 = melhor). Um valor igual ao corte fica na
+# classe de baixo, como no 'x <= quartil' original; NaN fica na última faixa.
+def classify(valores, cortes, maior_melhor=False):
+    codes = np.searchsorted(np.asarray(cortes), np.asarray(valores), side='left')
+    if maior_melhor:
+        codes = len(cortes) - codes
+    return codes.astype(np.int8)
+
+
+# Adiciona as classes de R, F e V e o RFV_Score à tabela RFV. O score é
+# montado a partir dos códigos inteiros (r*n² + f*n + v), sem concatenar textos.
+def rfv_segments(df_RFV, cortes=None, n_classes=4):
+    if cortes is None:
+        cortes = quantile_edges(df_RFV, n_classes)
+    letras = class_letters(n_classes)
+
+    score = np.zeros(len(df_RFV), dtype=np.int32)
+    for col in RFV_COLUMNS:
+        codes = classify(df_RFV[col], cortes[col].to_numpy(), MAIOR_MELHOR[col])
+        df_RFV[CLASS_COLUMNS[col]] = pd.Categorical.from_codes(codes, categories=letras)
+        score = score * n_classes + codes
+
+    rotulos = [r + f + v for r in letras for f in letras for v in letras]
+    df_RFV['RFV_Score'] = pd.Categorical.from_codes(score, categories=rotulos)
+    return df_RFV
+
+
+class RFVStore:
+    """Estado do RFV acumulado por cliente, persistido em um arquivo Parquet.
+
+    Cada lote de compras novo é agregado sozinho e somado ao estado guardado
+    (última compra, quantidade e valor por cliente), então a atualização diária
+    custa o tamanho do lote e não o histórico inteiro. A recência e os cortes
+    dos quantis são recalculados a partir do estado, em relação à maior
+    DiaCompra já vista. Lotes já incorporados (pelo ID do conteúdo) são ignorados.
+    """
+
+    def __init__(self, path=RFV_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.reset(persistir=False)
+        if os.path.exists(path):
+            self._load()
+
+    def reset(self, persistir=True):
+        self.estado = pd.DataFrame({'DiaUltimaCompra': pd.Series(dtype='datetime64[ns]'),
+                                    'Frequencia': pd.Series(dtype='int64'),
+                                    'Valor': pd.Series(dtype='float64')},
+                                   index=pd.Index([], name='ID_cliente'))
+        self.dia_atual = None
+        self.lotes = set()
+        if persistir and os.path.exists(self.path):
+            os.remove(self.path)
+
+    @property
+    def n_clientes(self):
+        return len(self.estado)
+
+    # Identifica o conteúdo do histórico (muda a cada lote incorporado)
+    @property
+    def versao(self):
+        return hashlib.blake2b(','.join(sorted(self.lotes)).encode(), digest_size=8).hexdigest()
+
+    # Incorpora um lote de compras; retorna False se o lote já foi incorporado
+    def update(self, df_compras, lote_id=None):
+        if lote_id is not None and lote_id in self.lotes:
+            return False
+        return self.merge_state(aggregate_purchases(df_compras), df_compras['DiaCompra'].max(), lote_id)
+
+    # Incorpora um lote já agregado por cliente (saída de aggregate_purchases,
+    # ou do GROUP BY do backend SQL) cuja última compra é maior_dia
+    def merge_state(self, parcial, maior_dia, lote_id=None):
+        with self._lock:
+            if lote_id is not None and lote_id in self.lotes:
+                return False
+
+            existentes = parcial.index.isin(self.estado.index)
+            ids = parcial.index[existentes]
+            if len(ids):
+                atual = self.estado.loc[ids]
+                novo = parcial.loc[ids]
+                self.estado.loc[ids, 'DiaUltimaCompra'] = np.maximum(
+                    atual['DiaUltimaCompra'].to_numpy(), novo['DiaUltimaCompra'].to_numpy())
+                self.estado.loc[ids, 'Frequencia'] = (atual['Frequencia'].to_numpy()
+                                                      + novo['Frequencia'].to_numpy())
+                self.estado.loc[ids, 'Valor'] = (atual['Valor'].to_numpy()
+                                                 + novo['Valor'].to_numpy())
+            if not len(self.estado):
+                self.estado = parcial.copy()
+            elif not existentes.all():
+                self.estado = pd.concat([self.estado, parcial[~existentes]]).sort_index()
+
+            if self.dia_atual is None or maior_dia > self.dia_atual:
+                self.dia_atual = maior_dia
+            if lote_id is not None:
+                self.lotes.add(lote_id)
+            self._save()
+            return True
+
+    # Tabela RFV do histórico acumulado (mesmo formato de rfv_table)
+    def table(self, dia_atual=None):
+        return add_recency(self.estado, dia_atual if dia_atual is not None else self.dia_atual)
+
+    def _save(self):
+        if pa is None:
+            raise ImportError('O histórico RFV requer o pacote pyarrow.')
+        tabela = pa.Table.from_pandas(self.estado)
+        meta = dict(tabela.schema.metadata or {})
+        meta[b'rfv_store'] = json.dumps({
+            'dia_atual': None if self.dia_atual is None else self.dia_atual.isoformat(),
+            'lotes': sorted(self.lotes),
+        }).encode()
+        # grava num temporário e troca, para não deixar o arquivo pela metade
+        temporario = self.path + '.tmp'
+        pa_parquet.write_table(tabela.replace_schema_metadata(meta), temporario)
+        os.replace(temporario, self.path)
+
+    def _load(self):
+        tabela = pa_parquet.read_table(self.path)
+        meta = json.loads(tabela.schema.metadata[b'rfv_store'])
+        self.estado = tabela.to_pandas()
+        self.dia_atual = None if meta['dia_atual'] is None else pd.Timestamp(meta['dia_atual'])
+        self.lotes = set(meta['lotes'])
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+from rfv import RFV_COLUMNS, aggregate_purchases, add_recency, rfv_segments
+
+# Tamanho dos compactadores do KLL: o erro de posição dos quantis fica em
+# torno de 2/k (k=200 -> ~1% dos clientes), com memória O(k log n)
+SKETCH_K = int(os.environ.get('RFV_SKETCH_K', 200))
+SKETCH_PARTITIONS = int(os.environ.get('RFV_SKETCH_PARTITIONS', 16))
+SKETCH_CHUNK_ROWS = int(os.environ.get('RFV_SKETCH_CHUNK_ROWS', 1_000_000))
+EPOCA = np.datetime64('1970-01-01', 'D')
+
+
+class KLLSketch:
+    """Sketch de quantis KLL: mergeable e com erro de posição limitado.
+
+    Os valores entram no nível 0; quando um nível passa da sua capacidade ele
+    é ordenado e metade dos itens (pares ou ímpares, ao acaso) sobe para o
+    nível seguinte com o dobro do peso. Dois sketches se juntam somando os
+    níveis e compactando de novo.
+    """
+
+    def __init__(self, k=SKETCH_K, random_state=None):
+        self.k = k
+        self.n = 0
+        self.niveis = [np.empty(0)]
+        self._rng = np.random.default_rng(random_state)
+
+    def _capacidade(self, nivel):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.niveis) - 1 - nivel))))
+
+    def _compactar(self):
+        nivel = 0
+        while nivel < len(self.niveis):
+            itens = self.niveis[nivel]
+            if len(itens) > self._capacidade(nivel):
+                if nivel + 1 == len(self.niveis):
+                    self.niveis.append(np.empty(0))
+                itens = np.sort(itens)
+                # com quantidade ímpar, o último item fica no nível atual
+                par = len(itens) - len(itens) % 2
+                promovidos = itens[self._rng.integers(2):par:2]
+                self.niveis[nivel + 1] = np.concatenate([self.niveis[nivel + 1], promovidos])
+                self.niveis[nivel] = itens[par:]
+            nivel += 1
+
+    def update(self, valores):
+        valores = np.asarray(valores, dtype=np.float64).ravel()
+        valores = valores[~np.isnan(valores)]
+        self.n += len(valores)
+        self.niveis[0] = np.concatenate([self.niveis[0], valores])
+        self._compactar()
+        return self
+
+    def merge(self, outro):
+        for nivel, itens in enumerate(outro.niveis):
+            if nivel == len(self.niveis):
+                self.niveis.append(np.empty(0))
+            self.niveis[nivel] = np.concatenate([self.niveis[nivel], itens])
+        self.n += outro.n
+        self._compactar()
+        return self
+
+    def quantiles(self, q):
+        itens = np.concatenate(self.niveis)
+        if not len(itens):
+            return np.full(len(np.atleast_1d(q)), np.nan)
+        pesos = np.concatenate([np.full(len(nivel), 2.0 ** i) for i, nivel in enumerate(self.niveis)])
+        ordem = np.argsort(itens, kind='stable')
+        acumulado = np.cumsum(pesos[ordem])
+        posicoes = np.searchsorted(acumulado, np.atleast_1d(q) * acumulado[-1], side='left')
+        return itens[ordem][np.minimum(posicoes, len(itens) - 1)]
+
+    @property
+    def retained(self):
+        return sum(len(nivel) for nivel in self.niveis)
+
+    def to_dict(self):
+        return {'k': self.k, 'n': self.n, 'niveis': [nivel.tolist() for nivel in self.niveis]}
+
+    @classmethod
+    def from_dict(cls, dados):
+        sketch = cls(dados['k'])
+        sketch.n = dados['n']
+        sketch.niveis = [np.asarray(nivel, dtype=np.float64) for nivel in dados['niveis']]
+        return sketch
+
+
+class RFVSketch:
+    """Sketches das três componentes do RFV, um valor por cliente.
+
+    A recência é guardada como a data da última compra (em dias), que não
+    depende do dia de referência; os cortes da recência saem dos quantis
+    dessa data. Sketches de partições com clientes diferentes podem ser
+    juntados com merge().
+    """
+
+    def __init__(self, k=SKETCH_K, random_state=None):
+        self.sketches = {col: KLLSketch(k, random_state) for col in ('UltimaCompra', 'Frequencia', 'Valor')}
+        self.dia_atual = None
+
+    # Incorpora o estado final de um grupo de clientes (saída de aggregate_purchases)
+    def update(self, estado):
+        dias = (estado['DiaUltimaCompra'].to_numpy().astype('datetime64[D]') - EPOCA).astype(np.int64)
+        self.sketches['UltimaCompra'].update(dias)
+        self.sketches['Frequencia'].update(estado['Frequencia'].to_numpy())
+        self.sketches['Valor'].update(estado['Valor'].to_numpy())
+        if len(estado):
+            maior = estado['DiaUltimaCompra'].max()
+            self.dia_atual = maior if self.dia_atual is None else max(self.dia_atual, maior)
+        return self
+
+    def merge(self, outro):
+        for col, sketch in self.sketches.items():
+            sketch.merge(outro.sketches[col])
+        if outro.dia_atual is not None:
+            self.dia_atual = outro.dia_atual if self.dia_atual is None else max(self.dia_atual, outro.dia_atual)
+        return self
+
+    @property
+    def n(self):
+        return self.sketches['Frequencia'].n
+
+    # Cortes no mesmo formato de quantile_edges (índice q, colunas R, F e V)
+    def edges(self, n_classes=4, dia_atual=None):
+        dia_atual = pd.Timestamp(dia_atual if dia_atual is not None else self.dia_atual)
+        q = np.array([i / n_classes for i in range(1, n_classes)])
+        # recência = dia_atual - última compra, então o quantil q da recência
+        # é dia_atual menos o quantil 1-q da data da última compra
+        dias_atual = (np.datetime64(dia_atual, 'D') - EPOCA).astype(np.int64)
+        cortes = {'Recencia': dias_atual - self.sketches['UltimaCompra'].quantiles(1 - q),
+                  'Frequencia': self.sketches['Frequencia'].quantiles(q),
+                  'Valor': self.sketches['Valor'].quantiles(q)}
+        return pd.DataFrame(cortes, index=q)[RFV_COLUMNS]
+
+    def to_dict(self):
+        return {'dia_atual': None if self.dia_atual is None else pd.Timestamp(self.dia_atual).isoformat(),
+                'sketches': {col: sketch.to_dict() for col, sketch in self.sketches.items()}}
+
+    @classmethod
+    def from_dict(cls, dados):
+        sketch = cls()
+        sketch.sketches = {col: KLLSketch.from_dict(s) for col, s in dados['sketches'].items()}
+        sketch.dia_atual = None if dados['dia_atual'] is None else pd.Timestamp(dados['dia_atual'])
+        return sketch
+
+
+# Blocos de compras lidos de um arquivo CSV ou Parquet
+def purchase_chunks(caminho, chunksize=SKETCH_CHUNK_ROWS):
+    if caminho.lower().endswith('.parquet'):
+        arquivo = pa_parquet.ParquetFile(caminho)
+        for lote in arquivo.iter_batches(batch_size=chunksize):
+            chunk = lote.to_pandas()
+            chunk['DiaCompra'] = pd.to_datetime(chunk['DiaCompra'])
+            yield chunk
+    else:
+        yield from pd.read_csv(caminho, parse_dates=['DiaCompra'], chunksize=chunksize)
+
+
+# Agregação das compras sem carregar a base inteira: cada bloco é agregado por
+# cliente e os parciais vão para n_particoes arquivos Arrow por hash do
+# ID_cliente, de modo que cada cliente fica numa única partição
+def partition_purchases(chunks, pasta, n_particoes=SKETCH_PARTITIONS):
+    if pa is None:
+        raise ImportError('O RFV por partições requer o pacote pyarrow.')
+    caminhos = [os.path.join(pasta, f'particao_{i}.arrow') for i in range(n_particoes)]
+    escritores = [None] * n_particoes
+    try:
+        for chunk in chunks:
+            parcial = aggregate_purchases(chunk).reset_index()
+            particao = pd.util.hash_array(parcial['ID_cliente'].to_numpy()) % n_particoes
+            for i, grupo in parcial.groupby(particao):
+                tabela = pa.Table.from_pandas(grupo, preserve_index=False)
+                if escritores[i] is None:
+                    escritores[i] = pa_ipc.new_stream(caminhos[i], tabela.schema)
+                escritores[i].write_table(tabela)
+    finally:
+        for escritor in escritores:
+            if escritor is not None:
+                escritor.close()
+    return [caminho for caminho, escritor in zip(caminhos, escritores) if escritor is not None]
+
+
+# Estado final (última compra, frequência e valor) dos clientes de uma partição
+def partition_state(caminho):
+    with pa.memory_map(caminho) as arquivo:
+        parciais = pa_ipc.open_stream(arquivo).read_all().to_pandas()
+    return parciais.groupby('ID_cliente').agg(DiaUltimaCompra=('DiaUltimaCompra', 'max'),
+                                              Frequencia=('Frequencia', 'sum'),
+                                              Valor=('Valor', 'sum'))
+
+
+# RFV da base de compras com memória limitada pelo tamanho da maior partição:
+# os cortes saem do sketch e, com saida, cada partição é classificada e gravada
+# em Parquet. Retorna (cortes, sketch).
+def rfv_out_of_core(caminho, n_classes=4, saida=None, n_particoes=SKETCH_PARTITIONS,
+                    chunksize=SKETCH_CHUNK_ROWS, k=SKETCH_K):
+    with tempfile.TemporaryDirectory() as pasta:
+        particoes = partition_purchases(purchase_chunks(caminho, chunksize), pasta, n_particoes)
+        sketch = RFVSketch(k, random_state=42)
+        for particao in particoes:
+            sketch.update(partition_state(particao))
+        cortes = sketch.edges(n_classes)
+
+        if saida is not None:
+            os.makedirs(saida, exist_ok=True)
+            for i, particao in enumerate(particoes):
+                df_RFV = add_recency(partition_state(particao), sketch.dia_atual)
+                df_RFV = rfv_segments(df_RFV, cortes, n_classes)
+                df_RFV.to_parquet(os.path.join(saida, f'rfv_{i}.parquet'))
+    return cortes, sketch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Cortes do RFV por sketch de quantis, sem carregar a base de compras inteira.')
+    parser.add_argument('compras', help='base de compras (csv ou parquet)')
+    parser.add_argument('--classes', type=int, default=4)
+    parser.add_argument('--k', type=int, default=SKETCH_K, help='tamanho do sketch (erro ~2/k)')
+    parser.add_argument('--particoes', type=int, default=SKETCH_PARTITIONS)
+    parser.add_argument('--sketch', help='grava o sketch em JSON (para juntar com outros)')
+    parser.add_argument('--saida', help='pasta para a tabela RFV classificada, em Parquet')
+    args = parser.parse_args(argv)
+
+    cortes, sketch = rfv_out_of_core(args.compras, args.classes, args.saida, args.particoes, k=args.k)
+    print(cortes.to_string())
+    if args.sketch:
+        with open(args.sketch, 'w') as arquivo:
+            json.dump(sketch.to_dict(), arquivo)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
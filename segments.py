@@ -0,0 +1,252 @@
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pa_compute
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pa = None
+
+from data_loader import stream_bank_data, IngestLimitError, UnsupportedFormatError
+from export import export_bytes, EXPORT_FORMATS
+from filter_index import FilterIndex, FILTER_COLUMNS
+from target_cube import TargetCube
+
+# Chaves aceitas em cada especificação de filtro, além das colunas da barra lateral
+SPEC_KEYS = {'nome', 'idade'}
+
+# Processos usados para gravar os extratos (0 = um por núcleo)
+SEGMENT_JOBS = int(os.environ.get('SEGMENT_JOBS', 0)) or os.cpu_count()
+
+
+class SpecError(Exception):
+    pass
+
+
+# Valida e normaliza uma especificação de filtro. Formato (JSON ou YAML):
+#   {"nome": "admin_casados", "idade": [25, 40], "job": ["admin."], "marital": ["married"]}
+# Colunas ausentes ficam sem restrição (igual a 'all'). Retorna
+# {'nome', 'idades' (tupla ou None), 'selecoes' (dict coluna -> lista)}.
+def parse_spec(spec, posicao=0):
+    if not isinstance(spec, dict):
+        raise SpecError(f'Especificação {posicao + 1}: esperado um objeto com os filtros.')
+    desconhecidas = set(spec) - SPEC_KEYS - set(FILTER_COLUMNS)
+    if desconhecidas:
+        raise SpecError(f'Especificação {posicao + 1}: chaves desconhecidas '
+                        f'{sorted(desconhecidas)}. Use nome, idade ou {FILTER_COLUMNS}.')
+
+    nome = str(spec.get('nome') or f'segmento_{posicao + 1}')
+    if not re.fullmatch(r'[\w.\-]+', nome):
+        raise SpecError(f'Nome de segmento inválido para arquivo: {nome!r}')
+
+    idades = spec.get('idade')
+    if idades is not None:
+        if not isinstance(idades, (list, tuple)) or len(idades) != 2:
+            raise SpecError(f'Segmento {nome}: idade deve ser [mínima, máxima].')
+        idades = (int(idades[0]), int(idades[1]))
+
+    selecoes = {}
+    for col in FILTER_COLUMNS:
+        if col in spec:
+            valores = spec[col]
+            if not isinstance(valores, (list, tuple)):
+                valores = [valores]
+            selecoes[col] = [str(valor) for valor in valores]
+    return {'nome': nome, 'idades': idades, 'selecoes': selecoes}
+
+
+# Lê as especificações de um arquivo .json, .yaml ou .yml (um objeto ou uma
+# lista de objetos). O YAML é lido sem conversão de tipos, para que valores
+# como yes/no continuem sendo texto, iguais aos da base.
+def load_specs(caminho):
+    extensao = os.path.splitext(caminho)[1].lower()
+    with open(caminho, encoding='utf-8') as arquivo:
+        if extensao in ('.yaml', '.yml'):
+            if yaml is None:
+                raise SpecError('Especificações em YAML requerem o pacote PyYAML.')
+            conteudo = yaml.load(arquivo, Loader=yaml.BaseLoader)
+        else:
+            conteudo = json.load(arquivo)
+    if isinstance(conteudo, dict):
+        conteudo = [conteudo]
+    return [parse_spec(spec, i) for i, spec in enumerate(conteudo or [])]
+
+
+# Especificações de todas as combinações de valores de duas (ou mais) colunas
+# da barra lateral, ex.: cross_specs(valores_unicos, 'job', 'month')
+def cross_specs(valores_unicos, *colunas):
+    specs = []
+    for combinacao in itertools.product(*(valores_unicos[col] for col in colunas)):
+        nome = '_'.join(f'{col}-{valor}' for col, valor in zip(colunas, combinacao))
+        spec = {col: [valor] for col, valor in zip(colunas, combinacao)}
+        spec['nome'] = re.sub(r'[^\w.\-]', '_', nome)
+        specs.append(parse_spec(spec, len(specs)))
+    return specs
+
+
+# Tabela de proporção da variável resposta do segmento (mesmo formato do app)
+def target_proportions(cube, idades=None, selecoes=None):
+    perc = cube.value_counts(idades, selecoes, normalize=True).reset_index()
+    perc.columns = ['y', 'proportion']
+    return perc
+
+
+# Linha do resumo: quantidade de linhas e proporção de cada valor de y
+def segment_summary(cube, spec):
+    contagem = cube.value_counts(spec['idades'], spec['selecoes']).sort_index()
+    total = int(contagem.sum())
+    linha = {'segmento': spec['nome'], 'linhas': total}
+    for valor, n in contagem.items():
+        linha[f'proporcao_{valor}'] = n / total if total else np.nan
+    return linha
+
+
+# Máscara Arrow da especificação, calculada direto na tabela mapeada
+def _arrow_mask(tabela, spec, age_col='age'):
+    partes = []
+    if spec['idades'] is not None:
+        idades = tabela[age_col]
+        partes.append(pa_compute.and_(pa_compute.greater_equal(idades, spec['idades'][0]),
+                                      pa_compute.less_equal(idades, spec['idades'][1])))
+    for col, selecionados in spec['selecoes'].items():
+        if 'all' not in selecionados:
+            # o conjunto de valores leva o tipo da coluna: uma seleção vazia
+            # viraria um array de tipo null, que o is_in rejeita
+            tipo = tabela.schema.field(col).type
+            if pa.types.is_dictionary(tipo):
+                tipo = tipo.value_type
+            partes.append(pa_compute.is_in(tabela[col], value_set=pa.array(selecionados, type=tipo)))
+    mask = None
+    for parte in partes:
+        mask = parte if mask is None else pa_compute.and_(mask, parte)
+    return mask
+
+
+# Tabela compartilhada de cada processo: o arquivo Arrow IPC sem compressão é
+# mapeado em memória, então os processos leem as mesmas páginas sem copiar a base
+_TABELA = None
+
+
+def _init_worker(caminho):
+    global _TABELA
+    _TABELA = pa_ipc.open_file(pa.memory_map(caminho)).read_all()
+
+
+def _write_extract(spec, saida, formato):
+    mask = _arrow_mask(_TABELA, spec)
+    filtrada = _TABELA if mask is None else _TABELA.filter(mask)
+    with open(os.path.join(saida, f"{spec['nome']}.{formato}"), 'wb') as arquivo:
+        arquivo.write(export_bytes(filtrada.to_pandas(), formato))
+    return filtrada.num_rows
+
+
+# Grava o extrato filtrado de cada especificação. Com mais de um processo a
+# base é gravada uma vez em Arrow IPC e compartilhada por memory map.
+def write_extracts(df, specs, saida, formato='parquet', n_jobs=SEGMENT_JOBS, filter_index=None):
+    os.makedirs(saida, exist_ok=True)
+    if n_jobs <= 1 or len(specs) <= 1 or pa is None:
+        filter_index = filter_index if filter_index is not None else FilterIndex(df)
+        for spec in specs:
+            with open(os.path.join(saida, f"{spec['nome']}.{formato}"), 'wb') as arquivo:
+                arquivo.write(export_bytes(filter_index.apply(df, spec['idades'], spec['selecoes']),
+                                           formato))
+        return
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'base.arrow')
+        tabela = pa.Table.from_pandas(df, preserve_index=False)
+        with pa_ipc.new_file(caminho, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+        del tabela
+
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                 initargs=(caminho,)) as executor:
+            list(executor.map(_write_extract, specs, itertools.repeat(saida),
+                              itertools.repeat(formato)))
+
+
+# Segmentação em lote: quantidade de linhas e proporções de y de cada
+# especificação, somadas no cubo da variável resposta (sem varrer a base).
+# Com saida, grava também os extratos filtrados em paralelo.
+def bulk_segments(df, specs, saida=None, formato='parquet', n_jobs=SEGMENT_JOBS, cube=None):
+    specs = [spec if 'selecoes' in spec else parse_spec(spec, i) for i, spec in enumerate(specs)]
+    cube = cube if cube is not None else TargetCube(df)
+    if saida is not None:
+        write_extracts(df, specs, saida, formato, n_jobs)
+    return pd.DataFrame([segment_summary(cube, spec) for spec in specs])
+
+
+# Gera, para cada especificação, o arquivo filtrado e a tabela de proporção
+# na pasta de saída, com a base lida e indexada uma única vez. Retorna o
+# resumo de todos os segmentos (também gravado em resumo.csv).
+def run_specs(df, specs, saida, formato='xlsx', extratos=True, n_jobs=SEGMENT_JOBS, cube=None):
+    os.makedirs(saida, exist_ok=True)
+    cube = cube if cube is not None else TargetCube(df)
+
+    resumo = bulk_segments(df, specs, saida if extratos else None, formato, n_jobs, cube)
+    for spec in specs:
+        with open(os.path.join(saida, f"{spec['nome']}_proporcao.{formato}"), 'wb') as arquivo:
+            arquivo.write(export_bytes(target_proportions(cube, spec['idades'], spec['selecoes']),
+                                       formato))
+    resumo.to_csv(os.path.join(saida, 'resumo.csv'), index=False)
+    return resumo
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Gera extratos filtrados e proporções de aceite da base '
+                    'bank marketing a partir de especificações de filtro.')
+    parser.add_argument('dados', help='base (csv, xlsx, parquet ou feather)')
+    parser.add_argument('specs', nargs='*', help='arquivos de especificação (.json, .yaml)')
+    parser.add_argument('--cruzar', nargs='+', metavar='COLUNA', choices=FILTER_COLUMNS,
+                        help='gera um segmento para cada combinação de valores das colunas')
+    parser.add_argument('-o', '--saida', default='segmentos', help='pasta de saída')
+    parser.add_argument('-f', '--formato', choices=list(EXPORT_FORMATS), default='xlsx')
+    parser.add_argument('--somente-proporcoes', action='store_true',
+                        help='não grava os extratos filtrados, só as proporções')
+    parser.add_argument('-j', '--jobs', type=int, default=SEGMENT_JOBS,
+                        help='processos para gravar os extratos (padrão: um por núcleo)')
+    args = parser.parse_args(argv)
+    if not args.specs and not args.cruzar:
+        parser.error('informe arquivos de especificação ou --cruzar')
+
+    try:
+        specs = [spec for caminho in args.specs for spec in load_specs(caminho)]
+    except (OSError, ValueError, SpecError) as erro:
+        parser.error(str(erro))
+    nomes = [spec['nome'] for spec in specs]
+    repetidos = sorted({nome for nome in nomes if nomes.count(nome) > 1})
+    if repetidos:
+        parser.error(f'Nomes de segmento repetidos: {repetidos}')
+
+    try:
+        with open(args.dados, 'rb') as arquivo:
+            df, valores_unicos = stream_bank_data(arquivo, args.dados)
+    except (OSError, IngestLimitError, UnsupportedFormatError) as erro:
+        parser.error(str(erro))
+    if args.cruzar:
+        specs += cross_specs(valores_unicos, *args.cruzar)
+
+    resumo = run_specs(df, specs, args.saida, args.formato,
+                       extratos=not args.somente_proporcoes, n_jobs=args.jobs)
+    print(resumo.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+try:
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+except ImportError:
+    Runtime = None
+
+from dataset_registry import REGISTRY
+
+
+# ID da sessão do Streamlit que está rodando o script (None fora do servidor)
+def current_session():
+    if Runtime is None:
+        return None
+    contexto = get_script_run_ctx(suppress_warning=True)
+    return contexto.session_id if contexto is not None else None
+
+
+# Marca a base como usada pela sessão atual, para que ela fique no cache
+# compartilhado enquanto alguma sessão a usar, e libera as bases das sessões
+# que já foram encerradas
+def use_dataset(dataset_id):
+    sessao = current_session()
+    if sessao is None:
+        return
+    REGISTRY.acquire(dataset_id, sessao)
+    if Runtime.exists():
+        runtime = Runtime.instance()
+        REGISTRY.release_inactive(runtime.is_active_session)
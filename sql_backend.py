@@ -0,0 +1,256 @@
+import importlib.util
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+
+from data_loader import detect_format, UnsupportedFormatError
+from disk_cache import evict_files
+from filter_index import FILTER_COLUMNS
+from startup import lazy_import
+
+# Backend dos apps: 'pandas' (base inteira em memória) ou 'duckdb' (base em
+# Parquet no disco, filtros e agregações em SQL)
+DATA_BACKEND = os.environ.get('DATA_BACKEND', 'pandas')
+# Pasta dos uploads convertidos para Parquet (um arquivo por conteúdo)
+DUCKDB_DIR = os.environ.get('DUCKDB_DIR', 'bases_duckdb')
+# Tamanho máximo da pasta; passando dele os arquivos usados há mais tempo e
+# que não estão abertos são apagados (0 = sem limite)
+DUCKDB_MAX_MB = int(os.environ.get('DUCKDB_MAX_MB', 4096))
+# Threads e limite de memória do DuckDB (vazio = padrão do DuckDB)
+DUCKDB_THREADS = int(os.environ.get('DUCKDB_THREADS', 0)) or None
+DUCKDB_MEMORY_LIMIT = os.environ.get('DUCKDB_MEMORY_LIMIT', '')
+COPY_BLOCK = 16 * 1024 ** 2
+CSV_TYPES = "['BIGINT', 'DOUBLE', 'DATE', 'TIMESTAMP', 'VARCHAR']"
+
+# Bases abertas por caminho; saem sozinhas quando o registro as descarta
+_ABERTAS = weakref.WeakValueDictionary()
+_lock_pasta = threading.Lock()
+
+
+# Usa o DuckDB só quando pedido no deploy e com o pacote instalado. O pacote
+# só é importado quando uma base é aberta, para não pesar na partida dos apps
+# que usam o backend pandas.
+def duckdb_enabled():
+    return DATA_BACKEND == 'duckdb' and importlib.util.find_spec('duckdb') is not None
+
+
+def _duckdb():
+    if importlib.util.find_spec('duckdb') is None:
+        raise ImportError('O backend SQL requer o pacote duckdb.')
+    return lazy_import('duckdb')
+
+
+def _quote(col):
+    return '"' + col.replace('"', '""') + '"'
+
+
+def _literal(texto):
+    return "'" + texto.replace("'", "''") + "'"
+
+
+# Grava o upload em Parquet na pasta do backend, lendo em blocos. CSV e Parquet
+# não passam pelo pandas; Excel é lido inteiro (a planilha já limita o tamanho).
+def persist_upload(file_data, dataset_id, name=None, pasta=DUCKDB_DIR):
+    caminho = os.path.join(pasta, f'{dataset_id}.parquet')
+    try:
+        # a data de modificação marca o último uso, para a remoção por LRU
+        os.utime(caminho)
+        return caminho
+    except FileNotFoundError:
+        pass
+    formato, sep = detect_format(file_data, name)
+    if formato in ('parquet', 'feather') and pa is None:
+        raise UnsupportedFormatError(f'Leitura de {formato} requer o pacote pyarrow.')
+
+    os.makedirs(pasta, exist_ok=True)
+    # grava num temporário da thread e troca, para não deixar o arquivo pela
+    # metade quando duas sessões convertem o mesmo upload ao mesmo tempo
+    temporario = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+    file_data.seek(0)
+    try:
+        if formato == 'parquet':
+            with open(temporario, 'wb') as destino:
+                shutil.copyfileobj(file_data, destino, COPY_BLOCK)
+        elif formato == 'feather':
+            leitor = pa_ipc.open_file(file_data)
+            with pa_parquet.ParquetWriter(temporario, leitor.schema) as escritor:
+                for i in range(leitor.num_record_batches):
+                    escritor.write_batch(leitor.get_batch(i))
+        elif formato in ('xlsx', 'xls'):
+            pd.read_excel(file_data).to_parquet(temporario, index=False)
+        else:
+            with tempfile.NamedTemporaryFile(suffix='.csv', dir=pasta, delete=False) as csv:
+                shutil.copyfileobj(file_data, csv, COPY_BLOCK)
+            try:
+                with _duckdb().connect() as con:
+                    # sem BOOLEAN na inferência: 'yes'/'no' continuam texto
+                    con.execute(f'COPY (SELECT * FROM read_csv({_literal(csv.name)}, '
+                                f'delim={_literal(sep)}, header=true, '
+                                f'auto_type_candidates={CSV_TYPES})) '
+                                f'TO {_literal(temporario)} (FORMAT parquet)')
+            finally:
+                os.remove(csv.name)
+        try:
+            os.replace(temporario, caminho)
+        except OSError:
+            # outra sessão terminou a mesma conversão antes
+            if not os.path.exists(caminho):
+                raise
+    finally:
+        file_data.seek(0)
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return caminho
+
+
+# Predicado SQL dos filtros da barra lateral, com os valores como parâmetros.
+# Mesma semântica do FilterIndex: 'all' não restringe a coluna, seleção vazia
+# não deixa passar nada e None (valor ausente) pode ser selecionado.
+def compile_filters(idades=None, selecoes=None, age_col='age'):
+    partes, params = [], []
+    if idades is not None:
+        partes.append(f'{_quote(age_col)} BETWEEN ? AND ?')
+        params += [idades[0], idades[1]]
+    for col, selecionados in (selecoes or {}).items():
+        if 'all' in selecionados:
+            continue
+        valores = [v for v in selecionados if v is not None and v == v]
+        condicoes = []
+        if valores:
+            condicoes.append(f"{_quote(col)} IN ({', '.join('?' * len(valores))})")
+            params += valores
+        if len(valores) < len(selecionados):
+            condicoes.append(f'{_quote(col)} IS NULL')
+        partes.append('(' + ' OR '.join(condicoes) + ')' if condicoes else 'FALSE')
+    return ' AND '.join(partes) or 'TRUE', params
+
+
+class DuckDataset:
+    """Base guardada em Parquet e consultada pelo DuckDB.
+
+    Segue a interface do FilterIndex e do TargetCube (head, apply e
+    value_counts, com o argumento df ignorado), então os apps trocam de
+    backend sem mudar o fluxo. Os filtros viram um único WHERE empurrado
+    para a leitura do Parquet e as contagens são agregadas no DuckDB; só as
+    prévias e os downloads voltam como DataFrame.
+    """
+
+    def __init__(self, caminho, columns=FILTER_COLUMNS, age_col='age', target='y'):
+        duckdb = _duckdb()
+        self.caminho = caminho
+        # custo no cache de memória: o tamanho do Parquet, como estimativa dos
+        # blocos que a conexão guarda em cache para a base
+        self.nbytes = os.path.getsize(caminho)
+        self.age_col = age_col
+        self.target = target
+        config = {}
+        if DUCKDB_THREADS:
+            config['threads'] = DUCKDB_THREADS
+        if DUCKDB_MEMORY_LIMIT:
+            config['memory_limit'] = DUCKDB_MEMORY_LIMIT
+        self._con = duckdb.connect(config=config)
+        self._lock = threading.Lock()
+        # file_row_number guarda a ordem das linhas do arquivo
+        self._con.execute(f'CREATE VIEW linhas AS SELECT * FROM read_parquet('
+                          f'{_literal(caminho)}, file_row_number=true)')
+        self._con.execute('CREATE VIEW base AS SELECT * EXCLUDE (file_row_number) FROM linhas')
+        self.column_names = [linha[0] for linha in self._query('DESCRIBE base').fetchall()]
+        self.columns = [col for col in columns if col in self.column_names]
+        self.n_rows = self._query('SELECT count(*) FROM base').fetchone()[0]
+        _ABERTAS[caminho] = self
+
+    # Cada consulta usa um cursor próprio: a conexão é compartilhada entre as
+    # sessões (threads) do Streamlit
+    def _query(self, sql, params=None):
+        with self._lock:
+            cursor = self._con.cursor()
+        return cursor.execute(sql, params or [])
+
+    @property
+    def file_size(self):
+        return os.path.getsize(self.caminho)
+
+    # Valores distintos da coluna na ordem de aparição (igual ao unique())
+    def unique_values(self, col):
+        sql = f'SELECT {_quote(col)} FROM linhas GROUP BY 1 ORDER BY min(file_row_number)'
+        return [linha[0] for linha in self._query(sql).fetchall()]
+
+    # Listas dos widgets no formato de stream_bank_data
+    def widget_values(self):
+        return {col: self.unique_values(col) for col in self.columns}
+
+    def value_range(self, col):
+        return self._query(f'SELECT min({_quote(col)}), max({_quote(col)}) FROM base').fetchone()
+
+    # Primeiras n linhas da base filtrada (LIMIT sem ORDER mantém a ordem do arquivo)
+    def head(self, df=None, idades=None, selecoes=None, n=5):
+        where, params = compile_filters(idades, selecoes, self.age_col)
+        return self._query(f'SELECT * FROM base WHERE {where} LIMIT {int(n)}', params).df()
+
+    # Base filtrada inteira, só para os downloads
+    def apply(self, df=None, idades=None, selecoes=None):
+        where, params = compile_filters(idades, selecoes, self.age_col)
+        return self._query(f'SELECT * FROM base WHERE {where}', params).df()
+
+    # Nos downloads a base filtrada já vem do DuckDB como DataFrame
+    def view(self, df=None, idades=None, selecoes=None):
+        return self.apply(df, idades, selecoes)
+
+    # Equivalente a df.y.value_counts() da base filtrada numa única agregação.
+    # O FILTER mantém os valores de y com contagem zero, como no TargetCube.
+    def value_counts(self, idades=None, selecoes=None, normalize=False):
+        where, params = compile_filters(idades, selecoes, self.age_col)
+        alvo = _quote(self.target)
+        contagem = self._query(f'SELECT {alvo}, count(*) FILTER (WHERE {where}) AS n '
+                               f'FROM linhas GROUP BY {alvo} '
+                               f'ORDER BY n DESC, min(file_row_number)', params).df()
+        valores = contagem['n'].astype('int64')
+        if normalize:
+            # mesma saída do TargetCube: proporção vazia quando o filtro não tem linhas
+            total = valores.sum()
+            if total == 0:
+                contagem = contagem.iloc[:0]
+            valores = contagem['n'] / total
+        nome = 'proportion' if normalize else 'count'
+        return pd.Series(valores.to_numpy(), index=pd.Index(contagem[self.target], name=self.target),
+                         name=nome)
+
+    # Estado do RFV por cliente (mesmo formato de aggregate_purchases) num
+    # GROUP BY do DuckDB; só a tabela por cliente volta para o pandas
+    def purchase_state(self):
+        estado = self._query('SELECT "ID_cliente", '
+                             'max(CAST("DiaCompra" AS TIMESTAMP)) AS "DiaUltimaCompra", '
+                             'count("CodigoCompra") AS "Frequencia", '
+                             'sum("ValorTotal") AS "Valor" '
+                             'FROM base GROUP BY "ID_cliente" ORDER BY "ID_cliente"').df()
+        estado['DiaUltimaCompra'] = estado['DiaUltimaCompra'].astype('datetime64[ns]')
+        estado['Frequencia'] = estado['Frequencia'].astype('int64')
+        estado['Valor'] = estado['Valor'].astype('float64')
+        return estado.set_index('ID_cliente')
+
+
+# Apaga os Parquets usados há mais tempo até a pasta caber em DUCKDB_MAX_MB,
+# mantendo os das bases abertas
+def evict_dir(pasta=DUCKDB_DIR, max_mb=DUCKDB_MAX_MB):
+    if not max_mb:
+        return None
+    with _lock_pasta:
+        return evict_files(pasta, '*.parquet', max_mb * 1024 ** 2, set(_ABERTAS.keys()))
+
+
+# Converte o upload e abre a base no DuckDB
+def open_upload(file_data, dataset_id, name=None):
+    dados = DuckDataset(persist_upload(file_data, dataset_id, name))
+    evict_dir()
+    return dados
@@ -0,0 +1,77 @@
+import functools
+import importlib
+import os
+import sys
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from instrumentation import IMPORT_TIMES, PerfRecorder, stage
+
+# Pré-carrega as bibliotecas pesadas numa thread depois da primeira página
+# desenhada, para que a primeira seção que as usa não espere a importação
+WARMUP = os.environ.get('WARMUP', '0') == '1'
+# Módulos que os apps só importam quando a seção que os usa é desenhada
+PLOT_MODULES = ['matplotlib.pyplot', 'seaborn']
+CLUSTER_MODULES = ['sklearn.cluster', 'sklearn.metrics', 'sklearn.preprocessing']
+SEABORN_PARAMS = {"axes.spines.right": False, "axes.spines.top": False}
+
+_lock = threading.Lock()
+_estado = {'partida': False, 'aquecimento': None}
+
+
+# Importa o módulo na primeira vez em que é pedido, medindo o tempo. O
+# import_module espera outra thread que esteja no meio da mesma importação.
+def lazy_import(nome):
+    if nome in sys.modules:
+        return importlib.import_module(nome)
+    with stage(f'import {nome}'):
+        inicio = time.perf_counter()
+        modulo = importlib.import_module(nome)
+        IMPORT_TIMES.setdefault(nome, round(time.perf_counter() - inicio, 4))
+    return modulo
+
+
+# seaborn e pyplot com o tema dos apps, configurado uma vez por processo
+@functools.lru_cache(maxsize=None)
+def plotting():
+    sns = lazy_import('seaborn')
+    plt = lazy_import('matplotlib.pyplot')
+    sns.set_theme(style='ticks', rc=SEABORN_PARAMS)
+    return sns, plt
+
+
+# Bytes de um arquivo estático (ícone, imagem da barra lateral), lidos uma vez
+# por processo. O Streamlit aceita os bytes direto, sem decodificar a imagem.
+@functools.lru_cache(maxsize=None)
+def static_asset(caminho):
+    with open(caminho, 'rb') as arquivo:
+        return arquivo.read()
+
+
+def _aquecer(app, modulos):
+    with PerfRecorder(app, 'aquecimento'):
+        if set(PLOT_MODULES) & set(modulos):
+            plotting()
+        for nome in modulos:
+            lazy_import(nome)
+
+
+# Chamado no fim de cada execução do app. Na primeira do processo registra a
+# partida (do início do processo até a primeira página desenhada) e, com
+# WARMUP=1, dispara a importação dos módulos em segundo plano.
+def after_first_paint(recorder, modulos=PLOT_MODULES):
+    with _lock:
+        if _estado['partida']:
+            return
+        _estado['partida'] = True
+    if psutil is not None:
+        recorder.record('partida', time.time() - psutil.Process().create_time())
+    if WARMUP:
+        _estado['aquecimento'] = threading.Thread(target=_aquecer, args=(recorder.app, modulos),
+                                                  name='aquecimento', daemon=True)
+        _estado['aquecimento'].start()
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+
+from filter_index import FILTER_COLUMNS
+
+
+def _codes(serie):
+    codes, uniques = pd.factorize(serie, use_na_sentinel=False)
+    tipo = np.int8 if len(uniques) < 2 ** 7 else np.int32
+    return codes.astype(tipo), pd.Index(uniques)
+
+
+class TargetCube:
+    """Cubo de contagens da variável resposta pré-calculado no carregamento.
+
+    Guarda, para cada combinação existente das dimensões categóricas da barra
+    lateral e de cada idade (faixas de 1 ano, o passo do slider), quantas
+    linhas têm cada valor de y. As proporções filtradas saem da soma das
+    células selecionadas, sem percorrer as linhas da base.
+    """
+
+    def __init__(self, df, columns=FILTER_COLUMNS, age_col='age', target='y'):
+        self.columns = [col for col in columns if col in df.columns]
+        self.age_col = age_col
+        self.target = target
+        self.values = {}
+
+        codigos = {}
+        for col in self.columns:
+            codigos[col], self.values[col] = _codes(df[col])
+        codigos[age_col] = df[age_col].to_numpy()
+        target_codes, self.target_values = _codes(df[target])
+        codigos[target] = target_codes
+
+        celulas = (pd.DataFrame(codigos)
+                   .groupby(list(codigos), sort=False)
+                   .size()
+                   .reset_index(name='count'))
+        self.cell_codes = {col: celulas[col].to_numpy() for col in self.columns}
+        self.cell_ages = celulas[age_col].to_numpy()
+        self.cell_target = celulas[target].to_numpy()
+        self.cell_counts = celulas['count'].to_numpy()
+
+    @property
+    def n_cells(self):
+        return len(self.cell_counts)
+
+    @property
+    def nbytes(self):
+        return (sum(codes.nbytes for codes in self.cell_codes.values())
+                + self.cell_ages.nbytes + self.cell_target.nbytes + self.cell_counts.nbytes)
+
+    # Máscara das células que atendem aos filtros (None = todas)
+    def _cell_mask(self, idades=None, selecoes=None):
+        mask = None
+        if idades is not None:
+            mask = (self.cell_ages >= idades[0]) & (self.cell_ages <= idades[1])
+        for col, selecionados in (selecoes or {}).items():
+            if 'all' in selecionados:
+                continue
+            codes = self.values[col].get_indexer(list(selecionados))
+            permitido = np.zeros(len(self.values[col]), dtype=bool)
+            permitido[codes[codes >= 0]] = True
+            col_mask = permitido[self.cell_codes[col]]
+            mask = col_mask if mask is None else mask & col_mask
+        return mask
+
+    # Equivalente a df.y.value_counts() da base filtrada, somando as células
+    def value_counts(self, idades=None, selecoes=None, normalize=False):
+        mask = self._cell_mask(idades, selecoes)
+        target = self.cell_target if mask is None else self.cell_target[mask]
+        pesos = self.cell_counts if mask is None else self.cell_counts[mask]
+        contagem = np.bincount(target, weights=pesos,
+                               minlength=len(self.target_values)).astype(np.int64)
+
+        if normalize:
+            # sem linhas no filtro, a proporção sai vazia como no value_counts()
+            # de um DataFrame vazio (e não NaN, que quebra o gráfico de pizza)
+            if contagem.sum() == 0:
+                return pd.Series([], index=self.target_values[:0].rename(self.target),
+                                 name='proportion', dtype=np.float64)
+            valores = contagem / contagem.sum()
+            nome = 'proportion'
+        else:
+            valores = contagem
+            nome = 'count'
+        serie = pd.Series(valores, index=self.target_values.rename(self.target), name=nome)
+        return serie.iloc[np.argsort(-contagem, kind='stable')]